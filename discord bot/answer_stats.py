@@ -0,0 +1,107 @@
+# answer_stats.py — per-question accuracy from the answer log (see events.py)
+#
+#   py answer_stats.py                         # everything under answer_log/
+#   py answer_stats.py --dir answer_log --min 20 --sort accuracy
+#   py answer_stats.py --csv stats.csv         # write the full table instead of printing
+#
+# Files are streamed one line at a time and folded into a few counters per
+# question, so memory depends on the number of questions, not events. Median
+# answer time comes from a per-question histogram of 100 ms buckets (capped at
+# 2 minutes) rather than from keeping every latency.
+
+import argparse
+import csv
+import sys
+
+from events import FIELDS, log_files, read_events
+
+BUCKET_MS = 100
+MAX_BUCKET = 1200   # 120 s; slower answers all land in the last bucket
+
+_QID, _OFFSET, _CHOICE, _CORRECT, _LATENCY = (FIELDS.index(f) for f in
+                                             ("question_id", "question_offset", "choice", "correct", "latency_ms"))
+
+
+class QuestionStats:
+    __slots__ = ("answered", "correct", "skipped", "hist")
+
+    def __init__(self):
+        self.answered = 0
+        self.correct = 0
+        self.skipped = 0
+        self.hist: dict[int, int] = {}   # {latency bucket: answers}
+
+    def median_ms(self) -> int | None:
+        half = sum(self.hist.values()) / 2
+        seen = 0
+        for bucket in sorted(self.hist):
+            seen += self.hist[bucket]
+            if seen >= half:
+                return bucket * BUCKET_MS + BUCKET_MS // 2
+        return None
+
+
+def aggregate(events) -> dict:
+    """Fold event rows into {question key: QuestionStats} (key = question id, else "@offset")."""
+    stats: dict = {}
+    for e in events:
+        key = e[_QID] if e[_QID] is not None else f"@{e[_OFFSET]}"
+        s = stats.get(key)
+        if s is None:
+            s = stats[key] = QuestionStats()
+        if e[_CHOICE] is None:
+            s.skipped += 1
+            continue
+        s.answered += 1
+        s.correct += bool(e[_CORRECT])
+        if e[_LATENCY] is not None:
+            b = min(e[_LATENCY] // BUCKET_MS, MAX_BUCKET)
+            s.hist[b] = s.hist.get(b, 0) + 1
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-question accuracy from the answer log.")
+    parser.add_argument("--dir", default="answer_log", help="answer log directory (default: %(default)s)")
+    parser.add_argument("--min", type=int, default=1, help="only questions answered at least this many times")
+    parser.add_argument("--sort", choices=("accuracy", "answered", "skipped", "time"), default="accuracy",
+                        help="order of the table (accuracy = hardest first)")
+    parser.add_argument("--limit", type=int, default=30, help="rows to print (0 = all)")
+    parser.add_argument("--csv", help="write every row to this CSV file instead of printing")
+    args = parser.parse_args()
+
+    files = log_files(args.dir)
+    if not files:
+        raise SystemExit(f"No answer logs in {args.dir}/")
+    stats = aggregate(read_events(files))
+
+    rows = []
+    for key, s in stats.items():
+        if s.answered < args.min:
+            continue
+        rows.append((key, s.answered, s.correct / s.answered if s.answered else 0.0, s.skipped, s.median_ms()))
+    order = {
+        "accuracy": lambda r: (r[2], -r[1]),
+        "answered": lambda r: -r[1],
+        "skipped": lambda r: -r[3],
+        "time": lambda r: -(r[4] or 0),
+    }[args.sort]
+    rows.sort(key=order)
+
+    total = sum(s.answered + s.skipped for s in stats.values())
+    print(f"{total} events, {len(stats)} questions from {len(files)} files", file=sys.stderr)
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(("question", "answered", "accuracy", "skipped", "median_ms"))
+            w.writerows((k, n, round(acc, 4), sk, med) for k, n, acc, sk, med in rows)
+        print(f"Wrote {args.csv}", file=sys.stderr)
+        return
+
+    print(f"{'question':>10} {'answered':>9} {'accuracy':>9} {'skipped':>8} {'median':>8}")
+    for k, n, acc, sk, med in rows[: args.limit or None]:
+        print(f"{k!s:>10} {n:>9} {acc:>8.1%} {sk:>8} {'' if med is None else f'{med / 1000:.1f}s':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+# bench.py — offline benchmark for the quiz flow (no Discord, no Supabase)
+#
+# Drives the real handlers in bot.py (!quiz → QuizView → AnswerButton →
+# NextQuestionView.yes … → no) with stub Interaction / Thread objects, against
+# fake_postgrest.FakePostgrest. Sent views are registered in discord.py's real
+# view store the same way discord.py does it, so memory numbers include them,
+# and clicks are routed through that store by custom_id like a gateway event
+# (message-bound views first, then the registered dynamic items).
+#
+#   py bench.py                                  # 10, 1k and 10k concurrent users
+#   py bench.py --users 500 --questions 10 --db-latency 0.02 --discord-latency 0.05
+#   py bench.py --restart                        # forget all sessions before anyone answers
+#   py bench.py --mode random                    # !quiz random (or --mode topic:trees)
+#   py bench.py --skip 0.2                       # click Skip on 20% of questions
+#   py bench.py --rate-limits                    # pace sends like Discord would (much slower)
+#   py bench.py --brownout                       # Supabase hangs while everyone plays
+#   py bench.py --db-error-rate 0.3              # …or fails 30% of requests
+#   py bench.py --workers 1 2 4 --users 500      # 1, 2, 4 processes × 500 users each
+#
+# Reports sessions/sec, per-click latency (p50/p95/p99) and memory per session.
+# With --workers it starts that many bot processes (like launcher.py does),
+# sharing one SQLite state file for their session claims, and reports the
+# events/sec (commands + clicks) they handle together.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from fake_postgrest import FakePostgrest
+
+_ids = itertools.count(10_000)
+# A syntactically valid (unsigned) JWT; the fake server never checks it.
+_FAKE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.bench"
+
+
+def make_questions(n: int) -> list[dict]:
+    topics = ["arrays", "trees", "graphs", "hashing", "sorting"]
+    return [{
+        "id": i + 1,
+        "kind": "mcq",
+        "published_at": f"2025-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}+00:00",
+        "title": f"Question {i + 1}: what is the worst-case cost of operation #{i}?",
+        "body": "",
+        "options": json.dumps([{"id": k, "text": f"O(n^{j})"} for j, k in enumerate("ABCD")]),
+        "answer_key": random.choice("ABCD"),
+        "explanation": "Because of reasons.",
+        "topic": topics[i % len(topics)],
+    } for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the quiz flow with fake Discord + fake PostgREST.")
+    parser.add_argument("--users", type=int, nargs="*", default=[10, 1_000, 10_000],
+                        help="concurrent users per run (several values = several runs)")
+    parser.add_argument("--questions", type=int, default=5, help="questions each user answers")
+    parser.add_argument("--bank", type=int, default=200, help="rows in the fake questions table")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="seconds added to every PostgREST request")
+    parser.add_argument("--discord-latency", type=float, default=0.0, help="seconds added to every Discord call")
+    parser.add_argument("--mode", default="", help="what follows !quiz, e.g. random or topic:trees")
+    parser.add_argument("--skip", type=float, default=0.0, help="fraction of questions skipped instead of answered")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="keep the per-channel outbound pacing on (off by default to measure the bot itself)")
+    parser.add_argument("--restart", action="store_true",
+                        help="drop every in-memory session after !quiz, as if the bot had restarted")
+    parser.add_argument("--db-error-rate", type=float, default=0.0, help="fraction of PostgREST requests that fail (503)")
+    parser.add_argument("--brownout", action="store_true",
+                        help="stall every PostgREST request while users answer (scores must spool, clicks stay fast)")
+    parser.add_argument("--workers", type=int, nargs="*",
+                        help="worker process counts to compare (each worker gets --users users)")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)        # set on the child processes
+    parser.add_argument("--state-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.workers:
+        return run_workers(args)
+
+    pg = FakePostgrest(
+        {"questions": make_questions(args.bank), "leaderboard": []},
+        unique={"leaderboard": ("guild_id", "user_id")},
+        columns={"leaderboard": {"id", "guild_id", "user_id", "username", "correct", "total", "submitted_at"}},
+        latency=args.db_latency,
+        error_rate=args.db_error_rate,
+    )
+    url = pg.start()
+    os.environ.update({
+        "SUPABASE_URL": url,
+        "SUPABASE_SERVICE_ROLE": _FAKE_KEY,
+        "STATE_BACKEND": "sqlite" if args.state_file else "memory",
+        "STATE_SQLITE_PATH": args.state_file or "",
+        "METRICS": os.getenv("METRICS", "1"),
+        "DISCORD_RATE_LIMITS": "1" if args.rate_limits else "0",
+    })
+    with tempfile.TemporaryDirectory() as log_dir:
+        os.environ.update({
+            "ANSWER_LOG_DIR": log_dir,
+            "QUESTION_SNAPSHOT": os.path.join(log_dir, "question_snapshot.json"),
+            "LEADERBOARD_SPOOL": os.path.join(log_dir, "leaderboard_spool.jsonl"),
+            "DB_TIMEOUT": os.getenv("DB_TIMEOUT", "1"),
+        })
+        try:
+            asyncio.run(_bench(args, pg))
+        finally:
+            pg.stop()
+
+
+def run_workers(args):
+    """Run the load in 1…N processes at once and report the events/sec they reach together."""
+    n = args.users[0]
+    passed = [f"--questions={args.questions}", f"--bank={args.bank}", f"--db-latency={args.db_latency}",
+              f"--discord-latency={args.discord_latency}", f"--skip={args.skip}"] + ([f"--mode={args.mode}"] if args.mode else [])
+    print(f"{n} users per worker · {args.questions} questions/session · {os.cpu_count()} CPUs\n")
+    print(f"{'workers':>8} {'events':>8} {'events/s':>10} {'per worker':>11}")
+    for count in args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = os.path.join(tmp, "quiz_state.sqlite3")
+            procs = [subprocess.Popen(
+                [sys.executable, __file__, "--users", str(n), "--worker", str(i), "--state-file", state_file, *passed],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+                env=dict(os.environ, WORKER_ID=f"bench-{i}"),
+            ) for i in range(count)]
+            # Every worker loads and builds its players first; then all start together
+            for p in procs:
+                if p.stdout.readline().strip() != "ready":
+                    raise SystemExit(f"worker exited early (status {p.wait()})")
+            for p in procs:
+                p.stdin.write("go\n")
+                p.stdin.flush()
+            reports = [json.loads(p.communicate()[0].splitlines()[-1]) for p in procs]
+        events = sum(r["events"] for r in reports)
+        rate = events / (max(r["t1"] for r in reports) - min(r["t0"] for r in reports))
+        print(f"{count:>8} {events:>8} {rate:>10.0f} {rate / count:>11.0f}")
+
+
+async def _bench(args, pg: FakePostgrest):
+    import logging
+    import discord
+    import bot as quizbot
+
+    logging.getLogger().setLevel(logging.WARNING)
+    state = quizbot.bot._connection
+    discord_latency = args.discord_latency
+
+    # ---------------- stub Discord objects ----------------
+    class FakeUser:
+        def __init__(self, uid: int):
+            self.id = uid
+            self.name = self.display_name = self.global_name = f"user{uid}"
+            self.mention = f"<@{uid}>"
+
+    class FakeMessage:
+        def __init__(self):
+            self.id = next(_ids)
+            self.message_id = self.id   # as on InteractionCallbackResponse
+
+    def deliver(thread, view, msg: FakeMessage | None = None) -> FakeMessage:
+        # What discord.py does after a successful send/edit: keep live views in the store
+        msg = msg or FakeMessage()
+        if view is not None and not view.is_finished() and view.is_dispatchable():
+            state.store_view(view, msg.id)
+        if view is not None:
+            thread.last_view, thread.last_sent = view, msg
+        return msg
+
+    class FakeGuild:
+        me = object()
+
+    class FakeThread(discord.Thread):
+        def __init__(self):   # deliberately skips Thread.__init__ (needs gateway payloads)
+            self.id = next(_ids)
+            self.guild = FakeGuild()
+            self.archived = False
+            self.locked = False
+            self.last_view = None
+            self.last_sent = None
+
+        def permissions_for(self, obj):
+            return discord.Permissions.all()
+
+        async def send(self, content=None, *, embed=None, view=None, **kwargs):
+            if discord_latency:
+                await asyncio.sleep(discord_latency)
+            return deliver(self, view)
+
+        async def join(self):
+            pass
+
+        async def edit(self, **kwargs):
+            self.archived = kwargs.get("archived", self.archived)
+
+    class FakeResponse:
+        def __init__(self, interaction):
+            self._i = interaction
+            self._done = False
+
+        def is_done(self) -> bool:
+            return self._done
+
+        async def send_message(self, content=None, *, embed=None, view=None, ephemeral=False, **kwargs):
+            self._done = True
+            return await self._i.channel.send(content, embed=embed, view=view)
+
+        async def edit_message(self, *, content=None, embed=None, view=None, **kwargs):
+            self._done = True
+            if discord_latency:
+                await asyncio.sleep(discord_latency)
+            deliver(self._i.channel, view, self._i.message)
+
+        async def defer(self, **kwargs):
+            self._done = True
+
+    class FakeFollowup:
+        def __init__(self, interaction):
+            self._i = interaction
+
+        async def send(self, content=None, *, embed=None, view=None, ephemeral=False, **kwargs):
+            return await self._i.channel.send(content, embed=embed, view=view)
+
+    class FakeInteraction:
+        def __init__(self, user: FakeUser, thread: FakeThread):
+            self.id = next(_ids)
+            self.user = user
+            self.channel = thread
+            self.guild_id = 1
+            self.message = thread.last_sent   # the message whose button was clicked
+            self.response = FakeResponse(self)
+            self.followup = FakeFollowup(self)
+
+    class FakeContext:
+        def __init__(self, user: FakeUser, thread: FakeThread):
+            self.author = user
+            self.channel = thread
+            self.guild = None
+
+        async def send(self, content=None, **kwargs):
+            return await self.channel.send(content, **kwargs)
+
+    # ---------------- one simulated player ----------------
+    async def click(latencies: list[float], user: FakeUser, thread: FakeThread, button):
+        # Route by custom_id the way discord.py's ViewStore does: message-bound
+        # views first, otherwise rebuild the item from a matching dynamic item template
+        interaction = FakeInteraction(user, thread)
+        key = (button.type.value, button.custom_id)
+        store = state._view_store
+        started = time.perf_counter()
+        item = store._views.get(interaction.message.id, {}).get(key) or store._views.get(None, {}).get(key)
+        if item is None:
+            for pattern, factory in store._dynamic_items.items():
+                match = pattern.fullmatch(button.custom_id)
+                if match is not None:
+                    item = await factory.from_custom_id(interaction, button.item, match)
+                    break
+        await item.callback(interaction)
+        latencies.append(time.perf_counter() - started)
+
+    async def play(user: FakeUser, thread: FakeThread, latencies: list[float]):
+        for i in range(args.questions):
+            buttons = thread.last_view.children
+            if random.random() < args.skip:
+                button = next(c for c in buttons if isinstance(c, quizbot.SkipButton))
+            else:
+                button = random.choice([c for c in buttons if isinstance(c, quizbot.AnswerButton)])
+            await click(latencies, user, thread, button)
+            prompt = thread.last_view
+            last = i == args.questions - 1
+            await click(latencies, user, thread, prompt.no if last else prompt.yes)
+
+    def live_views() -> int:
+        store = state._view_store
+        return len({id(item.view) for key, items in store._views.items() if key is not None
+                    for item in items.values()})
+
+    def reset_views():
+        store = state._view_store
+        for items in list(store._views.values()):
+            for item in list(items.values()):
+                if item.view is not None and not item.view.is_persistent() and not item.view.is_finished():
+                    item.view.stop()
+        persistent = store._views.pop(None, None)
+        store._views.clear()
+        store._synced_message_views.clear()
+        if persistent:
+            store._views[None] = persistent
+
+    def pct(data: list[float], p: float) -> float:
+        data = sorted(data)
+        return data[min(len(data) - 1, int(len(data) * p / 100))] * 1000 if data else 0.0
+
+    # ---------------- runs ----------------
+    await quizbot.QUESTIONS.load()
+    quizbot.register_persistent_views()
+    if args.worker is not None:
+        return await _worker_run(args, quizbot, FakeUser, FakeThread, FakeContext, play)
+    print(f"bank: {len(quizbot.QUESTIONS)} questions · db latency {args.db_latency * 1000:.0f} ms · "
+          f"discord latency {discord_latency * 1000:.0f} ms · {args.questions} questions/session\n")
+    print(f"{'users':>7} {'sessions/s':>11} {'click p50':>10} {'p95':>8} {'p99':>8} "
+          f"{'KiB/session':>12} {'live views':>11} {'db reqs':>8}")
+
+    for n in args.users:
+        quizbot.SCORES.clear()
+        quizbot.PROGRESS.clear()
+        quizbot.ACTIVE_USERS.clear()
+        quizbot.STATE.seen.clear()
+        quizbot.LEADERBOARD.start()
+        quizbot.ANSWERS.start()
+        db_before = pg.requests
+        players = [(FakeUser(next(_ids)), FakeThread()) for _ in range(n)]
+
+        # Phase 1: start every session, measuring what a waiting session costs
+        tracemalloc.start()
+        mem_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        await asyncio.gather(*(quizbot.quiz.callback(FakeContext(u, t), how=args.mode) for u, t in players))
+        mem_per_session = (tracemalloc.get_traced_memory()[0] - mem_before) / n / 1024
+        tracemalloc.stop()
+        if args.restart:
+            quizbot.SESSIONS.clear()
+            quizbot.ACTIVE_USERS.clear()
+
+        # Phase 2: everyone answers concurrently
+        latencies: list[float] = []
+        pg.stalled = args.brownout
+        await asyncio.gather(*(play(u, t, latencies) for u, t in players))
+        elapsed = time.perf_counter() - started
+        views_left = live_views()
+        await quizbot.LEADERBOARD.close()
+        if args.brownout:
+            lb = quizbot.LEADERBOARD.stats()
+            pg.stalled = False
+            await asyncio.sleep(quizbot.BREAKER.cooldown)   # wait for the breaker's trial call
+            await quizbot.LEADERBOARD.flush()
+            print(f"  brownout: circuit {quizbot.BREAKER.stats()} · spooled {lb['spooled']} rows, "
+                  f"replayed {quizbot.LEADERBOARD.replayed} once Supabase was back")
+        await quizbot.ANSWERS.close()
+
+        print(f"{n:>7} {n / elapsed:>11.1f} {pct(latencies, 50):>8.2f}ms {pct(latencies, 95):>6.2f}ms "
+              f"{pct(latencies, 99):>6.2f}ms {mem_per_session:>12.1f} {views_left:>11} {pg.requests - db_before:>8}")
+        reset_views()
+
+
+async def _worker_run(args, quizbot, FakeUser, FakeThread, FakeContext, play):
+    """One process of a --workers run: play --users sessions, then print what it handled as JSON."""
+    quizbot.STATE.start()
+    quizbot.LEADERBOARD.start()
+    ids = itertools.count(10_000 + args.worker * 10_000_000)   # this worker's shards own these users
+    players = [(FakeUser(next(ids)), FakeThread()) for _ in range(args.users[0])]
+    print("ready", flush=True)
+    await asyncio.to_thread(sys.stdin.readline)
+
+    t0 = time.time()
+    await asyncio.gather(*(quizbot.quiz.callback(FakeContext(u, t), how=args.mode) for u, t in players))
+    latencies: list[float] = []
+    await asyncio.gather(*(play(u, t, latencies) for u, t in players))
+    t1 = time.time()
+    await quizbot.LEADERBOARD.close()
+    await quizbot.STATE.close()
+    print(json.dumps({"events": len(players) + len(latencies), "t0": t0, "t1": t1}), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,31 @@
 # bot.py — MCQ-only, Supabase-backed questions, sequential per-user, per-player thread
 
-import os, json
+import os, asyncio, time, zlib
+_T0 = time.perf_counter()  # startup timing starts here (see "Startup & readiness")
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
-from supabase import create_client, Client
 import logging
 
+from db import BREAKER, LazyClient, shutdown_db
+from questions import QuestionStore, Shuffle
+from leaderboard import LeaderboardWriter, LeaderboardIndex
+from state import StateStore, MemoryBackend, SQLiteBackend, SupabaseBackend
+from outbound import OutboundScheduler, RESPONSE, NORMAL, LOW
+from events import AnswerLog
+import metrics
+
 logging.basicConfig(level=logging.INFO)
 
 from discord.errors import Forbidden
 
 async def _unarchive_if_needed(channel: discord.abc.Messageable):
+    metrics.incr("forbidden_unarchive_retry")
     if isinstance(channel, discord.Thread):
         try:
             if getattr(channel, "archived", False):
-                await channel.edit(archived=False)
+                await OUTBOUND.call("edit", channel.id, channel.edit, archived=False, priority=RESPONSE,
+                                    coalesce=("archive", channel.id, False))
         except Exception:
             pass
 
@@ -30,398 +40,738 @@ SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE") or os.getenv("SUPABASE_ANON_KE
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise SystemExit("Missing SUPABASE_URL and/or SUPABASE_SERVICE_ROLE (or SUPABASE_ANON_KEY) in .env")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# The supabase package (and its HTTP stack) is only imported on first use,
+# which happens in the startup warm-up while the gateway connects
+supabase = LazyClient(SUPABASE_URL, SUPABASE_KEY)
 
 # ---------------- Leaderboard helpers ----------------
 from datetime import datetime, timezone
 
 LEADERBOARD_TABLE = "leaderboard"  # Supabase table name
 
+# Scores are written behind the handlers, in batches (see leaderboard.py)
+LEADERBOARD = LeaderboardWriter(
+    supabase,
+    table=LEADERBOARD_TABLE,
+    batch_size=int(os.getenv("LEADERBOARD_BATCH_SIZE", "50")),
+    flush_interval=float(os.getenv("LEADERBOARD_FLUSH_INTERVAL", "2")),
+    # Rows that can't be written while Supabase is down wait here (empty = memory only)
+    spool_path=os.getenv("LEADERBOARD_SPOOL", "leaderboard_spool.jsonl") or None,
+)
+# …and read back from an in-memory, per-guild ranked copy (no DB round trip)
+LEADERBOARD_INDEX = LeaderboardIndex(supabase, table=LEADERBOARD_TABLE)
+LEADERBOARD_RESYNC_INTERVAL = float(os.getenv("LEADERBOARD_RESYNC_INTERVAL", "900"))
+
+async def resync_leaderboard_index():
+    await LEADERBOARD_INDEX.resync()
+    # Scores still waiting in the write queue are newer than what we just read
+    for row in LEADERBOARD.pending_rows():
+        LEADERBOARD_INDEX.update(row)
+
+async def resync_leaderboard_forever():
+    while True:
+        await asyncio.sleep(LEADERBOARD_RESYNC_INTERVAL)
+        try:
+            await resync_leaderboard_index()
+        except Exception:
+            logging.exception("Leaderboard resync failed; keeping previous index")
+
 def _now_iso():
     return datetime.now(timezone.utc).isoformat()
 
 def _display_name(user: discord.User | discord.Member) -> str:
     return user.display_name or user.global_name or user.name
 
-def submit_final_score(interaction: discord.Interaction, correct: int, total: int):
-    """Upsert one row per (guild, user). Stores Discord ID, displays username."""
-    gid = str(interaction.guild_id) if interaction.guild_id else "dm"
-    uid = str(interaction.user.id)
-    uname = _display_name(interaction.user)
+def submit_final_score(guild_id: int | None, user: discord.User | discord.Member, correct: int, total: int):
+    """Queue an upsert of one row per (guild, user). Stores Discord ID, displays username."""
+    gid = str(guild_id) if guild_id else "dm"
+    uid = str(user.id)
+    uname = _display_name(user)
 
-    supabase.table(LEADERBOARD_TABLE).upsert({
+    row = {
         "guild_id": gid,
         "user_id": uid,
         "username": uname,      # keeps last-seen display name
         "correct": int(correct),
         "total": int(total),
         "submitted_at": _now_iso(),
-    }, on_conflict="guild_id,user_id").execute()
+    }
+    LEADERBOARD.submit(row)
+    LEADERBOARD_INDEX.update(row)
 
 
 intents = discord.Intents.default()
 intents.message_content = True  # also toggle in Developer Portal → Bot → Message Content Intent
-bot = commands.Bot(command_prefix="!", intents=intents)
 
-# ---------------- Scores & Progress (in-memory) ----------------
-SCORES: dict[int, dict[str, int]] = {}     # {user_id: {"correct": int, "total": int}}
-PROGRESS: dict[int, int] = {}               # {user_id: next question offset (0-based)}
-ACTIVE_USERS: set[int] = set()              # prevent multiple sessions per user
-TOTAL_COUNT: int | None = None              # cache total mcq count
+# Sharding: set by launcher.py (or by hand). SHARD_COUNT=auto lets Discord pick;
+# SHARD_IDS="0,2" limits this process to those shards. Unset = one plain Bot.
+SHARD_COUNT = os.getenv("SHARD_COUNT")
+SHARD_IDS = os.getenv("SHARD_IDS")
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(
+        command_prefix="!",
+        intents=intents,
+        shard_count=None if SHARD_COUNT == "auto" else int(SHARD_COUNT),
+        shard_ids=[int(i) for i in SHARD_IDS.split(",")] if SHARD_IDS else None,
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
+
+# ---------------- Outbound messages (see outbound.py) ----------------
+# Hot-path sends/edits go through OUTBOUND so bursts are paced per channel
+# instead of turning into 429s. DISCORD_RATE_LIMITS=0 turns the pacing off.
+OUTBOUND = OutboundScheduler(enabled=os.getenv("DISCORD_RATE_LIMITS", "1") != "0")
+
+async def post(route: str, channel: discord.abc.Messageable, fn, *args, priority: int = NORMAL, **kwargs):
+    """OUTBOUND.call, plus the unarchive-and-retry-once for archived threads (paced as well)."""
+    try:
+        return await OUTBOUND.call(route, channel.id, fn, *args, priority=priority, **kwargs)
+    except Forbidden:
+        await _unarchive_if_needed(channel)
+        return await OUTBOUND.call(route, channel.id, fn, *args, priority=priority, **kwargs)
+
+# ---------------- Startup & readiness ----------------
+# setup_hook runs after the login request and before the gateway connects, so
+# it only does what a click needs (state, views); the question bank and the
+# leaderboard are warmed in the background while the gateway connects.
+# The bot is "ready" once it is on the gateway and the bank is loaded:
+# GET /ready on METRICS_PORT answers 200 from then on (503 before).
+STARTUP: dict[str, float] = {}   # {phase: ms}, filled in as startup goes
+_WARMUP: asyncio.Task | None = None
+_LOGIN_T0 = _GATEWAY_T0 = 0.0     # perf_counter() when login / the gateway connect started
+
+def _phase(name: str, since: float):
+    STARTUP[name] = round((time.perf_counter() - since) * 1000, 1)
+
+def is_ready() -> bool:
+    return bot.is_ready() and QUESTIONS.loaded and len(QUESTIONS) > 0
+
+def startup_summary() -> str:
+    order = ("imports", "login", "state", "questions", "leaderboard", "gateway", "ready")
+    return " · ".join(f"{name} {STARTUP[name]:.0f} ms" for name in order if name in STARTUP)
+
+async def _warm_questions():
+    started = time.perf_counter()
+    try:
+        await QUESTIONS.load()  # also probes which query plan this schema supports
+    except Exception:
+        logging.exception("Initial question bank load failed; will retry on first use")
+    _phase("questions", started)
+    _check_ready()
+
+async def _warm_leaderboard():
+    started = time.perf_counter()
+    try:
+        await resync_leaderboard_index()
+    except Exception:
+        logging.exception("Initial leaderboard sync failed; !leaderboard starts empty")
+    _phase("leaderboard", started)
+
+async def warm_up():
+    await asyncio.gather(_warm_questions(), _warm_leaderboard())
+    asyncio.create_task(QUESTIONS.refresh_forever())
+    asyncio.create_task(resync_leaderboard_forever())
+
+def _check_ready():
+    if "ready" not in STARTUP and is_ready():
+        _phase("ready", _T0)
+        logging.info("Ready: %s", startup_summary())
+
+@bot.event
+async def setup_hook():
+    global _WARMUP, _GATEWAY_T0
+    _phase("login", _LOGIN_T0)
+    # Readiness/metrics endpoint first, so the orchestrator sees 503 while we start
+    if os.getenv("METRICS_PORT"):
+        if metrics.ENABLED:
+            metrics.gauge("leaderboard_queue_depth", lambda: LEADERBOARD.queue_depth)
+            metrics.gauge("active_sessions", lambda: len(ACTIVE_USERS))
+            metrics.gauge("questions_loaded", lambda: len(QUESTIONS))
+            metrics.gauge("outbound_queue_depth", lambda: OUTBOUND.queue_depth)
+            metrics.gauge("ready", lambda: int(is_ready()))
+            metrics.gauge("db_circuit_open", lambda: int(BREAKER.state != "closed"))
+            metrics.gauge("questions_degraded", lambda: int(QUESTIONS.degraded))
+        await metrics.serve(os.getenv("METRICS_HOST", "127.0.0.1"), int(os.getenv("METRICS_PORT")), ready=is_ready)
+    # Restore everyone's scores/progress from the last run (clicks need it)
+    started = time.perf_counter()
+    await STATE.load()
+    STATE.start()
+    _phase("state", started)
+    register_persistent_views()
+    LEADERBOARD.start()
+    if ANSWERS is not None:
+        ANSWERS.start()
+    # Bank + leaderboard load while the gateway connects; a !quiz that
+    # arrives first just waits for the load already in flight.
+    _WARMUP = asyncio.create_task(warm_up())
+    _GATEWAY_T0 = time.perf_counter()
+
+@bot.event
+async def on_ready():
+    if "gateway" not in STARTUP:
+        _phase("gateway", _GATEWAY_T0)
+    _check_ready()
+
+# ---------------- Scores & Progress (persisted, see state.py) ----------------
+# STATE_BACKEND: "sqlite" (default, local file), "supabase" (quiz_state table) or "memory"
+# WORKER_ID tags this process's session claims so it can resume them after a
+# restart; it must be stable across restarts and unique among running workers.
+WORKER_ID = os.getenv("WORKER_ID") or (f"shards-{SHARD_IDS.replace(',', '-')}" if SHARD_IDS else "main")
+
+def _make_state_backend():
+    kind = os.getenv("STATE_BACKEND", "sqlite").lower()
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "supabase":
+        return SupabaseBackend(supabase, table=os.getenv("STATE_TABLE", "quiz_state"), owner=WORKER_ID,
+                               threads_table=os.getenv("STATE_THREADS_TABLE", "quiz_threads"))
+    return SQLiteBackend(os.getenv("STATE_SQLITE_PATH", "quiz_state.sqlite3"), owner=WORKER_ID)
+
+STATE = StateStore(_make_state_backend(), flush_interval=float(os.getenv("STATE_FLUSH_INTERVAL", "1")))
+SCORES = STATE.scores          # {user_id: {"correct": int, "total": int}}
+PROGRESS = STATE.progress      # {user_id: next question offset (0-based)}
+ACTIVE_USERS = STATE.active    # sessions running in this process (claimed via STATE.begin_session)
 
 def record_result(user_id: int, correct: bool):
     s = SCORES.setdefault(user_id, {"correct": 0, "total": 0})
     s["total"] += 1
     if correct:
         s["correct"] += 1
+    STATE.touch(user_id)
+
+def set_progress(user_id: int, offset: int):
+    PROGRESS[user_id] = offset
+    STATE.touch(user_id)
+
 
 def get_score(user_id: int) -> tuple[int, int]:
     s = SCORES.get(user_id, {"correct": 0, "total": 0})
     return s["correct"], s["total"]
 
-# ---------------- Supabase helpers (sequential) ----------------
+# ---------------- Answer events (see events.py) ----------------
+# Every answer/skip is appended to local files in ANSWER_LOG_DIR (empty = off)
+# for difficulty analytics: `py answer_stats.py` summarises them offline.
+# ANSWER_LOG_UPLOAD=1 also bulk-uploads finished files to the answer_events table.
+ANSWER_LOG_DIR = os.getenv("ANSWER_LOG_DIR", "answer_log")
+ANSWERS = AnswerLog(
+    ANSWER_LOG_DIR,
+    client=supabase if os.getenv("ANSWER_LOG_UPLOAD", "0") == "1" else None,
+    table=os.getenv("ANSWER_LOG_TABLE", "answer_events"),
+    rotate_bytes=int(float(os.getenv("ANSWER_LOG_ROTATE_MB", "16")) * (1 << 20)),
+) if ANSWER_LOG_DIR else None
+
+def record_answer(interaction: discord.Interaction, session: "QuizSession", choice: int | None, correct: bool):
+    if ANSWERS is None:
+        return
+    latency = None if session.shown_at is None else time.monotonic() - session.shown_at
+    ANSWERS.record(session.user_id, interaction.guild_id, session.question, session.offset, choice, correct, latency)
+
 # ---------------- Supabase helpers (sequential, schema-aware for your CSV) ----------------
+# Questions are loaded in bulk into QUESTIONS (see questions.py) and served from memory.
+
+QUESTION_CACHE_TTL = float(os.getenv("QUESTION_CACHE_TTL", "3600"))       # seconds between full reloads
+QUESTION_SYNC_INTERVAL = float(os.getenv("QUESTION_SYNC_INTERVAL", "30"))  # seconds between checks for new rows
+# QUESTION_BANK: load a file written by ingest.py instead of querying the table
+# QUESTION_SNAPSHOT: last good copy of the table, served if Supabase is down at startup
+QUESTIONS = QuestionStore(supabase, page_size=int(os.getenv("QUESTION_PAGE_SIZE", "1000")), ttl=QUESTION_CACHE_TTL,
+                          bank_path=os.getenv("QUESTION_BANK") or None, sync_interval=QUESTION_SYNC_INTERVAL,
+                          snapshot_path=os.getenv("QUESTION_SNAPSHOT", "question_snapshot.json") or None)
 
-def _normalize_question(row: dict) -> dict:
+
+async def ensure_total_count() -> int:
     """
-    Your schema:
-      title (str) = question text
-      body (str)  = subtitle/extra text (optional)
-      options     = JSON array of {id: "A|B|C|D", text: "..."}
-      answer_key  = "A" | "B" | "C" | "D"
-    We convert to bot's canonical shape:
-      prompt, choices[list[str]], answer[int], explanation(str|""), topic(str|"")
+    Count MCQs in the (cached) question bank. Loads it on first use.
     """
-    # Question text
-    title = row.get("title")
-    body  = row.get("body") or ""
-    if not isinstance(title, str) or not title.strip():
-        raise RuntimeError("Missing 'title' for question.")
-
-    prompt = title.strip()
-    if body and isinstance(body, str) and body.strip():
-        prompt = f"{title.strip()}\n\n{body.strip()}"
-
-    # Options can be a JSON string or already a list
-    opts_raw = row.get("options")
-    if isinstance(opts_raw, str):
-        try:
-            options_list = json.loads(opts_raw)
-        except Exception:
-            raise RuntimeError("Could not parse 'options' JSON string.")
-    elif isinstance(opts_raw, list):
-        options_list = opts_raw
-    else:
-        raise RuntimeError("Invalid 'options' field; expected JSON string or list of objects.")
-
-    # Extract labels in A..D order as they appear
-    # Each option is like {"id":"A","text":"A programming language"}
-    if not all(isinstance(o, dict) and "text" in o for o in options_list):
-        raise RuntimeError("Invalid options entries; expected objects with a 'text' key.")
+    await QUESTIONS.ensure_loaded()
+    if len(QUESTIONS) == 0:
+        raise RuntimeError("No rows found in 'questions' table.")
+    return len(QUESTIONS)
 
-    choices = [o["text"] for o in options_list]
 
-    # Map answer_key ("A"/"B"/"C"/"D") to index by matching the option's id
-    answer_key = row.get("answer_key")
-    if isinstance(answer_key, str):
-        answer_key = answer_key.strip().upper()
-    else:
-        raise RuntimeError("Missing 'answer_key' (expected 'A'|'B'|'C'|'D').")
+async def fetch_mcq_by_offset(offset: int) -> dict:
+    """
+    Return the normalized question at `offset` from the in-memory bank (O(1)).
+    """
+    with metrics.timed("fetch_question"):
+        await QUESTIONS.ensure_loaded()
+        return QUESTIONS.get(offset)
 
-    # Find the index of the option whose "id" matches answer_key
-    ids = [o.get("id") for o in options_list]
-    try:
-        answer_index = ids.index(answer_key)
-    except ValueError:
-        # Fallback: some data might store the answer text instead of the key
-        try:
-            answer_index = choices.index(answer_key)
-        except ValueError:
-            raise RuntimeError("answer_key not found in options id/text.")
-
-    if not (0 <= answer_index < len(choices)):
-        raise RuntimeError("Computed answer index is out of range.")
-
-    return {
-        "prompt": prompt,
-        "choices": choices,
-        "answer": answer_index,
-        "explanation": row.get("explanation") or "",
-        "topic": row.get("topic") or "",
+def make_embed_for(q: dict) -> discord.Embed:
+    """
+    Build the quiz embed from a normalized question dict:
+    {
+      "prompt": str,
+      "choices": list[str],
+      "answer": int,
+      "explanation": str (optional),
+      "topic": str (optional),
+      "description": str (prompt + hint, see questions.compile_question)
     }
+    """
+    with metrics.timed("make_embed"):
+        embed = discord.Embed(title="Data Structures Quiz", description=q["description"])
+        if q.get("topic"):
+            embed.set_footer(text=f"Topic: {q['topic']}")
+        return embed
+
+
+# ---------------- Lookahead (prefetch upcoming questions) ----------------
+# While a user is reading a question we already build the next QUIZ_LOOKAHEAD
+# ones (see QuizSession.upcoming), so clicking "Yes" only has to send a message.
+QUIZ_LOOKAHEAD = int(os.getenv("QUIZ_LOOKAHEAD", "1"))
+PREFETCH: dict[int, dict[int, asyncio.Task]] = {}   # {user_id: {offset: Task -> (question, embed)}}
+
+async def _load_question(offset: int) -> tuple[dict, discord.Embed]:
+    q = await fetch_mcq_by_offset(offset)
+    return q, make_embed_for(q)
+
+def prefetch_questions(user_id: int, offsets: list[int]):
+    """Start loading these upcoming questions for this user in the background."""
+    if QUIZ_LOOKAHEAD <= 0:
+        return
+    buf = PREFETCH.setdefault(user_id, {})
+    # Anything no longer coming up can't be used any more
+    for off in [o for o in buf if o not in offsets]:
+        buf.pop(off).cancel()
+    for off in offsets:
+        if off not in buf:
+            buf[off] = asyncio.create_task(_load_question(off))
+
+async def next_question(user_id: int, offset: int) -> tuple[dict, discord.Embed]:
+    """Return (question, embed) for `offset`, using the prefetched copy if there is one."""
+    task = PREFETCH.get(user_id, {}).pop(offset, None)
+    if task is not None:
+        try:
+            return await task
+        except Exception:
+            logging.warning("Prefetch of offset %s failed; fetching again", offset)
+    return await _load_question(offset)
 
+def drop_prefetch(user_id: int):
+    for task in PREFETCH.pop(user_id, {}).values():
+        task.cancel()
 
-async def ensure_total_count() -> int:
-    """
-    Count MCQs. Prefer kind='mcq' if present; otherwise count all rows.
-    """
-    global TOTAL_COUNT
-    if TOTAL_COUNT is not None:
-        return TOTAL_COUNT
 
-    # Try kind='mcq'
-    try:
-        res = supabase.table("questions").select("id", count="exact").eq("kind", "mcq").execute()
-        cnt = res.count or (len(res.data) if res.data else 0)
-    except Exception:
-        cnt = 0
+# ---------------- Question selection ----------------
+# A session picks questions in one of three modes, also written into every
+# button's custom_id so a session can be resumed after a restart:
+#   "s"           sequential, from PROGRESS (plain !quiz)
+#   "r"           random order over the whole bank (!quiz random)
+#   "t<crc32>"    random order within one topic (!quiz topic:<name>)
+# Random orders are questions.Shuffle (lazy, a few ints per session) and skip
+# every offset in the user's seen-bitset, so nothing repeats until the pool is
+# used up. Nothing here touches the database.
 
-    if cnt == 0:
-        # Fallback: all rows
-        res2 = supabase.table("questions").select("id", count="exact").execute()
-        cnt = res2.count or (len(res2.data) if res2.data else 0)
+def topic_mode(topic: str) -> str:
+    return f"t{zlib.crc32(topic.strip().lower().encode()):08x}"
 
-    if cnt == 0:
-        raise RuntimeError("No rows found in 'questions' table.")
+def pool_for(mode: str):
+    """Offsets a random mode draws from; None if the topic no longer exists."""
+    if mode == "r":
+        return range(len(QUESTIONS))
+    for name in QUESTIONS.topics:
+        if topic_mode(name) == mode:
+            return QUESTIONS.topic_offsets(name)
+    return None
 
-    TOTAL_COUNT = cnt
-    return TOTAL_COUNT
 
+# ---------------- Sessions ----------------
+SESSION_TIMEOUT = 300  # seconds without a click before a quiz session ends
 
-def fetch_mcq_by_offset(offset: int) -> dict:
+class QuizSession:
     """
-    Fetch exactly one row by offset in a stable order.
-    We first try ordering by 'published_at' (ascending), then fall back to 'id'.
-    We also try to filter kind='mcq' first; if that returns nothing, we fetch from all rows.
+    Everything we keep for one running quiz. One per user — no per-question
+    objects; the question on screen is the (shared, read-only) dict from
+    QUESTIONS, kept so a bank reload can't swap it out under the user.
     """
-    def _fetch(with_kind: bool, order_by_published: bool):
-        q = supabase.table("questions").select("*")
-        if with_kind:
-            q = q.eq("kind", "mcq")
-        if order_by_published:
-            # primary order by published_at asc, add id as a tiebreaker if possible
-            try:
-                q = q.order("published_at", desc=False)
-                # Not all clients allow multiple .order; if it errors it will be caught
-                q = q.order("id", desc=False)
-            except Exception:
-                # If 'published_at' doesn't exist in this project, the server will complain when executing.
-                pass
-        else:
-            q = q.order("id", desc=False)
-
-        return q.range(offset, offset).execute()
-
-    data = None
-    # 1) kind + published_at
-    try:
-        res = _fetch(with_kind=True, order_by_published=True)
-        data = res.data or []
-    except Exception:
-        data = []
-
-    # 2) kind + id
-    if not data:
-        try:
-            res = _fetch(with_kind=True, order_by_published=False)
-            data = res.data or []
-        except Exception:
-            data = []
-
-    # 3) all rows + published_at
-    if not data:
+    __slots__ = ("user_id", "thread", "mode", "order", "offset", "question", "awaiting", "shown_at", "_timer")
+
+    def __init__(self, user_id: int, thread: discord.abc.Messageable, mode: str = "s"):
+        self.user_id = user_id
+        self.thread = thread
+        self.mode = mode                     # see "Question selection"
+        self.order: Shuffle | None = None    # random modes: created on first use
+        self.offset = -1                     # QUESTIONS offset of the question on screen
+        self.question: dict | None = None    # ...and the question itself (offsets move when the bank reloads)
+        self.awaiting: str | None = None     # "answer" | "next" | None (busy)
+        self.shown_at: float | None = None   # time.monotonic() when the question was sent (None after a restart)
+        self._timer: asyncio.TimerHandle | None = None
+
+    def _shuffle(self) -> Shuffle:
+        if self.order is None:
+            self.order = Shuffle(pool_for(self.mode) or [])
+        return self.order
+
+    def next_offset(self) -> int | None:
+        """The next question to show, or None when there are no more (bank must be loaded)."""
+        if self.mode == "s":
+            offset = PROGRESS.get(self.user_id, 0)
+            return offset if offset < len(QUESTIONS) else None
+        return self._shuffle().next(STATE.seen.get(self.user_id, 0))
+
+    def upcoming(self, k: int) -> list[int]:
+        """The next k offsets next_offset() will return (for prefetching)."""
+        if self.mode == "s":
+            start = PROGRESS.get(self.user_id, 0)
+            return list(range(start, min(start + k, len(QUESTIONS))))
+        return self._shuffle().peek(STATE.seen.get(self.user_id, 0), k)
+
+    def show(self, offset: int, q: dict):
+        """A question is now on screen and waiting for an answer."""
+        self.offset = offset
+        self.question = q
+        self.awaiting = "answer"
+        self.shown_at = time.monotonic()
+        STATE.mark_seen(self.user_id, offset)
+        if self.mode == "s":
+            set_progress(self.user_id, offset + 1)
+        prefetch_questions(self.user_id, self.upcoming(QUIZ_LOOKAHEAD))
+
+    def touch(self):
+        """(Re)start the inactivity timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(SESSION_TIMEOUT, lambda: loop.create_task(self.end("timeout")))
+
+    async def end(self, reason: str):
+        if SESSIONS.get(self.user_id) is not self:
+            return
+        del SESSIONS[self.user_id]
+        if self._timer is not None:
+            self._timer.cancel()
+        STATE.end_session(self.user_id)
+        drop_prefetch(self.user_id)
+        # Low-priority goodbye + archive: queued behind everyone's quiz traffic,
+        # so don't hold up the handler that ended the session
+        _CLEANUPS.add(task := asyncio.create_task(self._close_thread(reason)))
+        task.add_done_callback(_CLEANUPS.discard)
+
+    async def _close_thread(self, reason: str):
+        thread = self.thread
         try:
-            res = _fetch(with_kind=False, order_by_published=True)
-            data = res.data or []
+            if isinstance(thread, discord.Thread) and not thread.locked:
+                await post("send", thread, thread.send, f"(Session ended: {reason}. This thread will auto-archive soon.)",
+                           priority=LOW)
+                # Optional immediate archive; remove this next line if you prefer auto-archive only:
+                await OUTBOUND.call("edit", thread.id, thread.edit, archived=True, locked=False,
+                                    priority=LOW, coalesce=("archive", thread.id, True))
         except Exception:
-            data = []
-
-    # 4) all rows + id
-    if not data:
-        res = _fetch(with_kind=False, order_by_published=False)
-        data = res.data or []
+            logging.exception("Thread cleanup failed")
 
-    if not data:
-        raise IndexError("Offset out of bounds or no data returned.")
+SESSIONS: dict[int, QuizSession] = {}   # {user_id: running session in this process}
+_CLEANUPS: set[asyncio.Task] = set()    # thread cleanups in flight (keeps them referenced)
 
-    return _normalize_question(data[0])
- 
-def make_embed_for(q: dict) -> discord.Embed:
+async def _rehydrate_session(interaction: discord.Interaction, offset: int, qkey: str | None, awaiting: str,
+                             mode: str) -> QuizSession | None:
     """
-    Build the quiz embed from a normalized question dict:
-    {
-      "prompt": str,
-      "choices": list[str],
-      "answer": int,
-      "explanation": str (optional),
-      "topic": str (optional)
-    }
+    A click on a quiz message this process has no session for (e.g. sent
+    before a restart). Resume it with one state lookup — the claim, which also
+    refreshes the user's progress — if the message is still the latest one.
+    Random modes get a fresh order; the seen-bitset keeps it from repeating.
     """
-    desc = q["prompt"] + "\n\n*Click a button below to answer.*"
-    embed = discord.Embed(title="Data Structures Quiz", description=desc)
-    if q.get("topic"):
-        embed.set_footer(text=f"Topic: {q['topic']}")
-    return embed
+    user_id = interaction.user.id
+    q = _question_at(offset, qkey)
+    if q is None:
+        return None  # the bank changed since this message was sent: that offset is another question now
+    if mode != "s" and pool_for(mode) is None:
+        return None
+    if not await STATE.begin_session(user_id):
+        return None
+    if (PROGRESS.get(user_id, 0) != offset + 1) if mode == "s" else not STATE.has_seen(user_id, offset):
+        STATE.end_session(user_id)  # an old message; the user has moved on since
+        return None
+    session = SESSIONS[user_id] = QuizSession(user_id, interaction.channel, mode)
+    session.offset = offset
+    session.question = q
+    session.awaiting = awaiting
+    metrics.incr("session_rehydrated")
+    return session
+
+async def _session_for(interaction: discord.Interaction, user_id: int, offset: int, qkey: str | None,
+                       awaiting: str, mode: str) -> QuizSession | None:
+    """The owner's session, if this click is the one it is waiting for."""
+    if interaction.user.id != user_id:
+        return None
+    # Right after a restart the bank may still be loading in warm_up(); offsets mean nothing until it is in
+    await QUESTIONS.ensure_loaded()
+    session = SESSIONS.get(user_id)
+    if session is None:
+        session = await _rehydrate_session(interaction, offset, qkey, awaiting, mode)
+    if session is None or session.awaiting != awaiting or session.offset != offset:
+        return None
+    if qkey is not None and question_key(session.question) != qkey:
+        return None
+    session.awaiting = None  # busy until this click is handled (ignores double clicks)
+    session.touch()
+    return session
+
+async def _handle_click(session: QuizSession, awaiting: str, handler, interaction: discord.Interaction):
+    """Run a click handler; if it fails, the session waits for that click again instead of staying busy."""
+    try:
+        await handler(interaction, session)
+    except BaseException:
+        if session.awaiting is None and SESSIONS.get(session.user_id) is session:
+            session.awaiting = awaiting
+        raise
 
 
 # ---------------- Views ----------------
-class QuizView(discord.ui.View):
-    """MCQ buttons for a single question; then offers Next Question?"""
-    def __init__(self, question: dict, author_id: int, on_end):
-        super().__init__(timeout=300)
-        self.q = question
-        self.author_id = author_id
-        self.on_end = on_end
+# Buttons carry their own state in the custom_id —
+# dsquiz:<user>:<offset>:<mode>:q<question>:<action> — and are registered once at startup as dynamic items, so any quiz button
+# (even one sent before a restart) is routed by its custom_id alone. The views
+# attached to messages are only rendered: they are stopped before sending and
+# are therefore never kept in discord.py's view store.
+# (<mode> is missing from buttons sent before modes existed: those are sequential)
+# <question> is question_key(): a reload can move questions to other offsets, and
+# a click is only taken if the offset still holds the question that was shown.
+_CUSTOM_ID = r"dsquiz:(?P<user>\d+):(?P<offset>\d+):(?:(?P<mode>s|r|t[0-9a-f]{8}):)?(?:q(?P<qkey>\d+|h[0-9a-f]{8}):)?"
+
+def question_key(q: dict) -> str:
+    """Short stable id for a question: its row id, or a hash of the prompt for rows without one."""
+    if q["id"] is not None:
+        return str(q["id"])
+    return f"h{zlib.crc32(q['prompt'].encode()):08x}"
+
+def _question_at(offset: int, qkey: str | None) -> dict | None:
+    """The question at `offset`, if there is one and it is the one `qkey` names (None = don't check)."""
+    if not 0 <= offset < len(QUESTIONS):
+        return None
+    q = QUESTIONS.get(offset)
+    return q if qkey is None or question_key(q) == qkey else None
+
+def _finished(view: discord.ui.View) -> discord.ui.View:
+    view.stop()  # finished views are sent but never stored
+    return view
 
-        # Store the correct label before any shuffling
-        choices = question["choices"]
-        self.correct_label = choices[question["answer"]]
+class QuizView(discord.ui.View):
+    """MCQ buttons for a question (+ Skip); then offers Next Question?"""
+    def __init__(self, user_id: int, offset: int, mode: str, q: dict, disabled: bool = False):
+        super().__init__(timeout=None)
+        qkey = question_key(q)
 
         # Build buttons in the current order (no shuffle, since you're going sequential)
-        for idx, label in enumerate(choices):
-            self.add_item(AnswerButton(idx, label, self))
+        for idx, label in enumerate(q["choices"]):
+            self.add_item(AnswerButton(user_id, offset, mode, qkey, idx, label, disabled))
 
         # Optional skip (doesn't change score, advances via NextQuestionView)
-        self.add_item(SkipButton(self))
-
-    async def on_timeout(self):
-        for c in self.children:
-            if isinstance(c, discord.ui.Button):
-                c.disabled = True
-        if self.on_end:
-            await self.on_end(reason="timeout")
-
-class AnswerButton(discord.ui.Button):
-    def __init__(self, idx: int, label: str, parent_view: "QuizView"):
-        super().__init__(style=discord.ButtonStyle.primary, label=label)
+        self.add_item(SkipButton(user_id, offset, mode, qkey, disabled))
+
+class AnswerButton(discord.ui.DynamicItem[discord.ui.Button], template=_CUSTOM_ID + r"a(?P<idx>\d+)"):
+    def __init__(self, user_id: int, offset: int, mode: str, qkey: str | None, idx: int, label: str = "",
+                 disabled: bool = False):
+        super().__init__(discord.ui.Button(
+            style=discord.ButtonStyle.primary, label=label, disabled=disabled,
+            custom_id=f"dsquiz:{user_id}:{offset}:{mode}:q{qkey}:a{idx}",
+        ))
+        self.user_id = user_id
+        self.offset = offset
+        self.mode = mode
+        self.qkey = qkey
         self.idx = idx
-        self.parent_view = parent_view
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match["user"]), int(match["offset"]), match["mode"] or "s", match["qkey"], int(match["idx"]),
+                   item.label or "")
 
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.parent_view.author_id:
+        session = await _session_for(interaction, self.user_id, self.offset, self.qkey, "answer", self.mode)
+        if session is None:
             return await interaction.response.send_message(
                 "This question isn’t for you 🙂. Run `!quiz` to start your own thread.",
                 ephemeral=True
             )
+        await _handle_click(session, "answer", self.answer, interaction)
 
-        # Disable buttons
-        for c in self.parent_view.children:
-            if isinstance(c, discord.ui.Button):
-                c.disabled = True
-
-        q = self.parent_view.q
+    async def answer(self, interaction: discord.Interaction, session: QuizSession):
+        q = session.question
         correct = (self.idx == q["answer"])
-        record_result(interaction.user.id, correct)
 
         if correct:
             text = f"✅ Correct!\n\n**Explanation:** {q.get('explanation','')}"
         else:
             text = (
-                f"❌ Incorrect. The correct answer was **{self.parent_view.correct_label}**.\n\n"
+                f"❌ Incorrect. The correct answer was **{q['choices'][q['answer']]}**.\n\n"
                 f"**Explanation:** {q.get('explanation','')}"
             )
 
-        # Edit result; if thread is archived, unarchive then retry once
-        try:
-            await interaction.response.edit_message(content=text, view=self.parent_view)
-        except Forbidden:
-            await _unarchive_if_needed(interaction.channel)
-            await interaction.response.edit_message(content=text, view=self.parent_view)
+        # Edit result (buttons disabled); if thread is archived, unarchive then retry once
+        done_view = _finished(QuizView(self.user_id, self.offset, self.mode, q, disabled=True))
+        with metrics.timed("discord_edit_message"):
+            await post("response", interaction.channel, interaction.response.edit_message,
+                       content=text, view=done_view)
+        # Scored only once the result is on screen, so a failed click can simply be retried
+        record_result(interaction.user.id, correct)
+        record_answer(interaction, session, self.idx, correct)
 
         # Follow-up "next question?" message with the same retry protection
+        session.awaiting = "next"
         corr, tot = get_score(interaction.user.id)
         prompt = f"Want the next one? (**Your score:** {corr}/{tot})"
-        try:
-            await interaction.followup.send(prompt, view=NextQuestionView(self.parent_view.author_id, self.parent_view.on_end))
-        except Forbidden:
-            await _unarchive_if_needed(interaction.channel)
-            await interaction.followup.send(prompt, view=NextQuestionView(self.parent_view.author_id, self.parent_view.on_end))
-
-class SkipButton(discord.ui.Button):
-    def __init__(self, parent_view: QuizView):
-        super().__init__(style=discord.ButtonStyle.secondary, label="Skip ⏭️")
-        self.parent_view = parent_view
+        next_view = _finished(NextQuestionView(self.user_id, self.offset, self.mode, self.qkey))
+        with metrics.timed("discord_followup_send"):
+            await post("followup", interaction.channel, interaction.followup.send, prompt, view=next_view,
+                       priority=RESPONSE)
+
+class SkipButton(discord.ui.DynamicItem[discord.ui.Button], template=_CUSTOM_ID + r"skip"):
+    def __init__(self, user_id: int, offset: int, mode: str, qkey: str | None, disabled: bool = False):
+        super().__init__(discord.ui.Button(
+            style=discord.ButtonStyle.secondary, label="Skip ⏭️", disabled=disabled,
+            custom_id=f"dsquiz:{user_id}:{offset}:{mode}:q{qkey}:skip",
+        ))
+        self.user_id = user_id
+        self.offset = offset
+        self.mode = mode
+        self.qkey = qkey
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match["user"]), int(match["offset"]), match["mode"] or "s", match["qkey"])
 
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.parent_view.author_id:
+        session = await _session_for(interaction, self.user_id, self.offset, self.qkey, "answer", self.mode)
+        if session is None:
             return await interaction.response.send_message("Not your quiz 🙂", ephemeral=True)
-
-        for c in self.parent_view.children:
-            if isinstance(c, discord.ui.Button):
-                c.disabled = True
-
-        await interaction.response.edit_message(
-            content=f"⏭️ Skipped. The correct answer was **{self.parent_view.correct_label}**.",
-            view=self.parent_view
-        )
-
-        corr, tot = get_score(self.parent_view.author_id)
-        await interaction.followup.send(
-            f"Want the next one? (**Your score:** {corr}/{tot})",
-            view=NextQuestionView(self.parent_view.author_id, self.parent_view.on_end)
-        )
+        await _handle_click(session, "answer", self.skip, interaction)
+
+    async def skip(self, interaction: discord.Interaction, session: QuizSession):
+        q = session.question
+        with metrics.timed("discord_edit_message"):
+            await post("response", interaction.channel, interaction.response.edit_message,
+                content=f"⏭️ Skipped. The correct answer was **{q['choices'][q['answer']]}**.",
+                view=_finished(QuizView(self.user_id, self.offset, self.mode, q, disabled=True))
+            )
+        record_answer(interaction, session, None, False)
+
+        session.awaiting = "next"
+        corr, tot = get_score(session.user_id)
+        with metrics.timed("discord_followup_send"):
+            await post("followup", interaction.channel, interaction.followup.send,
+                f"Want the next one? (**Your score:** {corr}/{tot})",
+                view=_finished(NextQuestionView(self.user_id, self.offset, self.mode, self.qkey)),
+                priority=RESPONSE
+            )
 
 class NextQuestionView(discord.ui.View):
     """Prompt to continue with Yes/No."""
-    def __init__(self, author_id: int, on_end):
-        super().__init__(timeout=300)  # was 30; give users more time
-        self.author_id = author_id
-        self.on_end = on_end
-
-    async def on_timeout(self):
-        for c in self.children:
-            if isinstance(c, discord.ui.Button):
-                c.disabled = True
-        # Do NOT call on_end() here (which might archive); just let thread live
-
-    @discord.ui.button(label="Yes", style=discord.ButtonStyle.success)
-    async def yes(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if interaction.user.id != self.author_id:
-            return await interaction.response.send_message("This prompt isn’t for you 🙂.", ephemeral=True)
+    def __init__(self, user_id: int, offset: int, mode: str, qkey: str | None):
+        super().__init__(timeout=None)
+        self.yes = NextButton(user_id, offset, mode, qkey, "yes")
+        self.no = NextButton(user_id, offset, mode, qkey, "no")
+        self.add_item(self.yes)
+        self.add_item(self.no)
+
+class NextButton(discord.ui.DynamicItem[discord.ui.Button], template=_CUSTOM_ID + r"(?P<action>yes|no)"):
+    def __init__(self, user_id: int, offset: int, mode: str, qkey: str | None, action: str):
+        super().__init__(discord.ui.Button(
+            label="Yes" if action == "yes" else "No",
+            style=discord.ButtonStyle.success if action == "yes" else discord.ButtonStyle.secondary,
+            custom_id=f"dsquiz:{user_id}:{offset}:{mode}:q{qkey}:{action}",
+        ))
+        self.user_id = user_id
+        self.offset = offset   # the question that was just answered
+        self.mode = mode
+        self.qkey = qkey
+        self.action = action
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match["user"]), int(match["offset"]), match["mode"] or "s", match["qkey"], match["action"])
 
-        total = await ensure_total_count()
-        offset = PROGRESS.get(self.author_id, 0)
-        if offset >= total:
-            corr, tot = get_score(self.author_id)
-            try:
-                await interaction.response.send_message(f"🎉 You’ve reached the end! Final score: **{corr}/{tot}**")
-            except Forbidden:
-                await _unarchive_if_needed(interaction.channel)
-                await interaction.response.send_message(f"🎉 You’ve reached the end! Final score: **{corr}/{tot}**")
+    async def callback(self, interaction: discord.Interaction):
+        session = await _session_for(interaction, self.user_id, self.offset, self.qkey, "next", self.mode)
+        if session is None:
+            return await interaction.response.send_message("This prompt isn’t for you 🙂.", ephemeral=True)
+        await _handle_click(session, "next", self.yes if self.action == "yes" else self.no, interaction)
+
+    async def yes(self, interaction: discord.Interaction, session: QuizSession):
+        user_id = session.user_id
+        await ensure_total_count()
+        offset = session.next_offset()
+        if offset is None:
+            corr, tot = get_score(user_id)
+            await post("response", interaction.channel, interaction.response.send_message,
+                       f"🎉 You’ve reached the end! Final score: **{corr}/{tot}**")
             
             # NEW: record to Supabase leaderboard
-            submit_final_score(interaction, corr, tot)
+            submit_final_score(interaction.guild_id, interaction.user, corr, tot)
             
-            if self.on_end:
-                await self.on_end(reason="complete")
+            await session.end(reason="complete")
             return
 
-        # Next question (sequential)
-        q = fetch_mcq_by_offset(offset)
-        embed = make_embed_for(q)
-        try:
-            await interaction.response.send_message(embed=embed, view=QuizView(q, self.author_id, self.on_end))
-        except Forbidden:
-            await _unarchive_if_needed(interaction.channel)
-            await interaction.response.send_message(embed=embed, view=QuizView(q, self.author_id, self.on_end))
-        PROGRESS[self.author_id] = offset + 1
-
-    @discord.ui.button(label="No", style=discord.ButtonStyle.secondary)
-    async def no(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if interaction.user.id != self.author_id:
-            return await interaction.response.send_message("This prompt isn’t for you 🙂.", ephemeral=True)
-        corr, tot = get_score(self.author_id)
-        try:
-            await interaction.response.send_message(f"All good! Final score: **{corr}/{tot}**. Thanks for playing!")
-        except Forbidden:
-            await _unarchive_if_needed(interaction.channel)
-            await interaction.response.send_message(f"All good! Final score: **{corr}/{tot}**. Thanks for playing!")
+        # Next question (usually already prefetched)
+        q, embed = await next_question(user_id, offset)
+        view = _finished(QuizView(user_id, offset, session.mode, q))
+        with metrics.timed("discord_send_message"):
+            await post("response", interaction.channel, interaction.response.send_message, embed=embed, view=view)
+        session.show(offset, q)
+
+    async def no(self, interaction: discord.Interaction, session: QuizSession):
+        corr, tot = get_score(session.user_id)
+        await post("response", interaction.channel, interaction.response.send_message,
+                   f"All good! Final score: **{corr}/{tot}**. Thanks for playing!")
         
         # NEW: record to Supabase leaderboard
-        submit_final_score(interaction, corr, tot)
+        submit_final_score(interaction.guild_id, interaction.user, corr, tot)
         
-        if self.on_end:
-            await self.on_end(reason="user-finished")
+        await session.end(reason="user-finished")
+
+def register_persistent_views():
+    """Route every quiz button by its custom_id — including ones sent before a restart."""
+    bot.add_dynamic_items(AnswerButton, SkipButton, NextButton, LiveAnswerButton)
 
 # ---------------- Thread/session helpers ----------------
-async def start_quiz_in_thread(ctx: commands.Context):
-    """Create (or reuse) a thread for this user and start the session there, sequentially."""
+# Each user gets one quiz thread per channel, reused by every later !quiz
+# (see STATE.threads). Archived threads drop out of discord.py's cache, so we
+# keep the Thread objects here ourselves: {thread_id: Thread}.
+_THREADS: dict[int, discord.Thread] = {}
+
+def _can_post_in(thread: discord.Thread) -> bool:
+    """True if cached permissions already say we may post here (no API call)."""
+    me = thread.guild.me
+    if me is None:
+        return False
+    try:
+        return thread.permissions_for(me).send_messages_in_threads
+    except discord.ClientException:
+        return False  # parent channel not cached
+
+async def _reuse_quiz_thread(ctx: commands.Context) -> discord.Thread | None:
+    """The user's quiz thread from an earlier !quiz in this channel, if it still exists."""
+    key = (ctx.channel.id, ctx.author.id)
+    thread_id = STATE.threads.get(key)
+    if thread_id is None:
+        return None
+    thread = _THREADS.get(thread_id) or ctx.guild.get_thread(thread_id)
+    if thread is None:
+        # Not cached since a restart: one fetch, then it is remembered
+        try:
+            thread = await ctx.guild.fetch_channel(thread_id)
+        except (discord.NotFound, discord.Forbidden):
+            STATE.forget_thread(*key)
+            return None
+    if not isinstance(thread, discord.Thread) or thread.locked:
+        STATE.forget_thread(*key)
+        return None
+    # No unarchive call needed: posting in an archived (unlocked) thread reopens it
+    _THREADS[thread_id] = thread
+    return thread
+
+async def start_quiz_in_thread(ctx: commands.Context, mode: str = "s", *, _retry: bool = True):
+    """Create (or reuse) a thread for this user and start the session there (see "Question selection")."""
     thread: discord.abc.Messageable | None = None
+    reused = False
 
     # Reuse current thread if already inside one
     if isinstance(ctx.channel, discord.Thread):
         thread = ctx.channel
 
+    # Otherwise reuse this user's quiz thread from last time, if any
+    elif isinstance(ctx.channel, (discord.ForumChannel, discord.TextChannel, discord.VoiceChannel)) \
+            and (thread := await _reuse_quiz_thread(ctx)) is not None:
+        reused = True
+
     # Forum channel: must create a post (thread) with initial content
     elif isinstance(ctx.channel, discord.ForumChannel):
         name = f"quiz-{ctx.author.display_name}".replace("/", "-")[:90]
@@ -458,80 +808,419 @@ async def start_quiz_in_thread(ctx: commands.Context):
     else:
         return await ctx.send("❌ I can only start quizzes in Text or Forum channels.")
 
-    # Ensure bot is a member of the thread before sending
-    try:
-        await thread.join()
-    except Exception:
-        pass  # fine if already joined
+    if thread is not ctx.channel and not reused:
+        STATE.remember_thread(ctx.channel.id, ctx.author.id, thread.id)
+        _THREADS[thread.id] = thread
 
-    # Quick speak test inside the thread (for non-forum threads)
-    try:
-        if not isinstance(ctx.channel, discord.ForumChannel):
-            await thread.send(f"{ctx.author.mention} setting up your quiz…")
-    except discord.Forbidden:
-        return await ctx.send("❌ I can’t post in the thread. Please allow **Send Messages in Threads**.")
-    except discord.HTTPException as e:
-        return await ctx.send(f"❌ I couldn’t post in the thread. ({e})")
-
-    # Session bookkeeping + cleanup helper
-    ACTIVE_USERS.add(ctx.author.id)
-
-    async def end_session(reason: str):
-        ACTIVE_USERS.discard(ctx.author.id)
+    # Join + speak test, only when cached permissions can't already vouch for us
+    # (we're a member of threads we create, and public threads don't need it)
+    if not (isinstance(thread, discord.Thread) and _can_post_in(thread)):
+        # Ensure bot is a member of the thread before sending
         try:
-            if isinstance(thread, discord.Thread) and not thread.locked:
-                await thread.send(f"(Session ended: {reason}. This thread will auto-archive soon.)")
-                # Optional immediate archive; remove this next line if you prefer auto-archive only:
-                await thread.edit(archived=True, locked=False)
+            await thread.join()
         except Exception:
-            logging.exception("Thread cleanup failed")
+            pass  # fine if already joined
+
+        # Quick speak test inside the thread (for non-forum threads)
+        try:
+            if not isinstance(ctx.channel, discord.ForumChannel):
+                await thread.send(f"{ctx.author.mention} setting up your quiz…")
+        except discord.Forbidden:
+            return await ctx.send("❌ I can’t post in the thread. Please allow **Send Messages in Threads**.")
+        except discord.HTTPException as e:
+            return await ctx.send(f"❌ I couldn’t post in the thread. ({e})")
+
+    # Session bookkeeping + cleanup helper. The claim goes through the state
+    # backend so a user can't run two quizzes in two worker processes.
+    if not await STATE.begin_session(ctx.author.id):
+        return await thread.send(f"{ctx.author.mention} you already have a running quiz. Finish it or wait for it to time out.")
+
+    session = SESSIONS[ctx.author.id] = QuizSession(ctx.author.id, thread, mode)
+    session.touch()
 
     # Initialize progress
     if ctx.author.id not in PROGRESS:
-        PROGRESS[ctx.author.id] = 0
+        set_progress(ctx.author.id, 0)
 
-    # Fetch first (or next) question sequentially
+    # Fetch first (or next) question
     try:
-        total = await ensure_total_count()
-        offset = PROGRESS.get(ctx.author.id, 0)
-        if offset >= total:
-            return await thread.send(
+        await ensure_total_count()
+        offset = session.next_offset()
+        if offset is None and mode != "s":
+            # Seen everything in this pool: go round again
+            STATE.clear_seen(ctx.author.id, pool_for(mode))
+            session.order = None
+            offset = session.next_offset()
+        if offset is None:
+            await post("send", thread, thread.send,
                 f"{ctx.author.mention} You’ve finished all questions! Use `!score` or ask a mod to run `!resetprogress`."
             )
+            return await session.end("complete")
 
-        q = fetch_mcq_by_offset(offset)
-        embed = make_embed_for(q)
-        await thread.send(content="🎯 First question:" if offset == 0 else "➡️ Next question:", embed=embed, view=QuizView(q, ctx.author.id, end_session))
-        PROGRESS[ctx.author.id] = offset + 1
+        q, embed = await next_question(ctx.author.id, offset)
+        content = "🎯 First question:" if mode != "s" or offset == 0 else "➡️ Next question:"
+        if reused:
+            content = f"{ctx.author.mention} {content}"  # ping them: the thread may be scrolled away
+        with metrics.timed("discord_thread_send"):
+            await post("send", thread, thread.send, content=content, embed=embed,
+                       view=_finished(QuizView(ctx.author.id, offset, mode, q)))
+        session.show(offset, q)
 
     except Exception as e:
-        await thread.send(f"❌ Error starting quiz: `{e}`")
+        if reused and isinstance(e, (discord.NotFound, discord.Forbidden)):
+            # The remembered thread was deleted / locked meanwhile: forget it and start over once
+            logging.info("Quiz thread %s unusable (%s); creating a new one", thread.id, e)
+            STATE.forget_thread(ctx.channel.id, ctx.author.id)
+            _THREADS.pop(thread.id, None)
+            session.thread = None  # nothing left to post to or archive
+            await session.end("thread-gone")
+            if _retry:
+                await start_quiz_in_thread(ctx, mode, _retry=False)
+            return
+        await post("send", thread, thread.send, f"❌ Error starting quiz: `{e}`", priority=LOW)
         logging.exception("Error while starting quiz")
-        await end_session("error")
+        await session.end("error")
+
+
+# ---------------- Live rounds ----------------
+# !liveround: one shared question message for the whole channel instead of a
+# thread per player. Every click goes through LiveAnswerButton.callback, which
+# only updates in-memory tallies for the round (one answer per user per
+# question, checked with a set). When time is up the question message is
+# edited once with the results; at the end each player's round is added to
+# their overall score and all of them go to the leaderboard writer together. Per question that is one fetch, one send and
+# one edit, however many people play (plus Discord's per-click response).
+LIVE_ROUNDS: dict[int, "LiveRound"] = {}   # {channel_id: round running there}
+LIVE_MAX_QUESTIONS = 20
+LIVE_SECONDS = (5, 120)                   # allowed time per question
+
+class LiveRound:
+    __slots__ = ("channel", "order", "offset", "question", "accepting", "answered", "counts", "correct_users",
+                 "shown_at", "players")
+
+    def __init__(self, channel: discord.abc.Messageable, order: Shuffle):
+        self.channel = channel
+        self.order = order
+        self.offset = -1                  # question on screen
+        self.question: dict | None = None
+        self.accepting = False
+        self.answered: set[int] = set()   # user ids that answered the current question
+        self.counts: list[int] = []       # clicks per choice
+        self.correct_users: list[str] = []   # display names, in answer order
+        self.shown_at = 0.0
+        self.players: dict[int, list] = {}   # {user_id: [correct, answered, user]}
+
+    def show(self, offset: int, q: dict):
+        self.offset = offset
+        self.question = q
+        self.answered = set()
+        self.counts = [0] * len(q["choices"])
+        self.correct_users = []
+        self.shown_at = time.monotonic()
+        self.accepting = True
+
+    def answer(self, interaction: discord.Interaction, idx: int) -> bool | None:
+        """Tally one click. Returns whether it was right, or None if it doesn't count."""
+        user = interaction.user
+        if not self.accepting or user.id in self.answered or not 0 <= idx < len(self.counts):
+            return None
+        self.answered.add(user.id)
+        self.counts[idx] += 1
+        q = self.question
+        correct = idx == q["answer"]
+        p = self.players.get(user.id)
+        if p is None:
+            p = self.players[user.id] = [0, 0, user]
+        p[0] += correct
+        p[1] += 1
+        if correct:
+            self.correct_users.append(_display_name(user))
+        if ANSWERS is not None:
+            ANSWERS.record(user.id, interaction.guild_id, q, self.offset, idx, correct,
+                           time.monotonic() - self.shown_at)
+        return correct
+
+    def results(self, q: dict) -> str:
+        total = len(self.answered)
+        lines = []
+        for i, (label, n) in enumerate(zip(q["choices"], self.counts)):
+            mark = "✅" if i == q["answer"] else "▫️"
+            pct = f"{n * 100 // total}%" if total else "0%"
+            lines.append(f"{mark} **{label}** — {n} ({pct})")
+        if self.correct_users:
+            first = ", ".join(self.correct_users[:3])
+            lines.append(f"\n⚡ Fastest: {first}")
+        lines.append(f"**{len(self.correct_users)}/{total}** got it right.")
+        if q.get("explanation"):
+            lines.append(f"\n**Explanation:** {q['explanation']}")
+        return "\n".join(lines)[:4000]
+
+    def standings(self, limit: int = 10) -> list[tuple[str, int, int]]:
+        ranked = sorted(self.players.values(), key=lambda p: (-p[0], p[1]))
+        return [(_display_name(u), c, n) for c, n, u in ranked[:limit]]
+
+class LiveView(discord.ui.View):
+    """The shared answer buttons of a live round question."""
+    def __init__(self, channel_id: int, offset: int, q: dict, disabled: bool = False):
+        super().__init__(timeout=None)
+        for idx, label in enumerate(q["choices"]):
+            self.add_item(LiveAnswerButton(channel_id, offset, idx, label, disabled))
+
+class LiveAnswerButton(discord.ui.DynamicItem[discord.ui.Button],
+                       template=r"dslive:(?P<channel>\d+):(?P<offset>\d+):a(?P<idx>\d+)"):
+    def __init__(self, channel_id: int, offset: int, idx: int, label: str = "", disabled: bool = False):
+        super().__init__(discord.ui.Button(
+            style=discord.ButtonStyle.primary, label=label, disabled=disabled,
+            custom_id=f"dslive:{channel_id}:{offset}:a{idx}",
+        ))
+        self.channel_id = channel_id
+        self.offset = offset
+        self.idx = idx
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match["channel"]), int(match["offset"]), int(match["idx"]), item.label or "")
+
+    async def callback(self, interaction: discord.Interaction):
+        live = LIVE_ROUNDS.get(self.channel_id)
+        if live is None or live.offset != self.offset or not live.accepting:
+            text = "⌛ Too late — this question is closed."
+        elif live.answer(interaction, self.idx) is None:
+            text = "You already answered this one 🙂"
+        else:
+            text = f"🔒 Locked in: **{self.item.label}**"
+        await post("response", interaction.channel, interaction.response.send_message, text, ephemeral=True)
+
+async def run_live_round(ctx: commands.Context, count: int, seconds: int, pool):
+    channel = ctx.channel
+    live = LIVE_ROUNDS[channel.id] = LiveRound(channel, Shuffle(pool))
+    try:
+        await post("send", channel, channel.send,
+                   f"🎤 **Live round!** {count} questions, {seconds}s each. Click an answer — first click counts.")
+        for i in range(1, count + 1):
+            offset = live.order.next()
+            if offset is None:
+                break
+            q, embed = await _load_question(offset)
+            embed.title = f"Live round — question {i}/{count}"
+            embed.set_footer(text=f"{seconds}s to answer" + (f" · Topic: {q['topic']}" if q.get("topic") else ""))
+            live.show(offset, q)
+            msg = await post("send", channel, channel.send, embed=embed,
+                             view=_finished(LiveView(channel.id, offset, q)))
+            await asyncio.sleep(seconds)
+            live.accepting = False
+            embed.add_field(name="Results", value=live.results(q)[:1024], inline=False)
+            embed.set_footer(text="Closed" + (f" · Topic: {q['topic']}" if q.get("topic") else ""))
+            await post("edit", channel, msg.edit, embed=embed,
+                       view=_finished(LiveView(channel.id, offset, q, disabled=True)))
+
+        await save_live_scores(ctx.guild.id if ctx.guild else None, live.players)
+        board = live.standings()
+        lines = [f"**{n}.** {name} — {c}/{t}" for n, (name, c, t) in enumerate(board, start=1)]
+        await post("send", channel, channel.send,
+                   "🏁 **Live round over!**\n" + ("\n".join(lines) if lines else "Nobody answered 😴"))
+    finally:
+        live.accepting = False
+        LIVE_ROUNDS.pop(channel.id, None)
+
+async def save_live_scores(guild_id: int | None, players: dict[int, list]):
+    """Add every player's live round to their overall score and queue them for the leaderboard."""
+    # A scores row belongs to whoever holds that user's session: players without
+    # one here are claimed first (which also re-reads their rows), so we neither
+    # write over another worker's newer score nor clear its claim with our flush.
+    # One bulk claim for the whole round, not a round trip per player.
+    others = [user_id for user_id in players if user_id not in ACTIVE_USERS]
+    claimed: set[int] = set()
+    if others:
+        try:
+            claimed = await STATE.begin_sessions(others)
+        except Exception:
+            logging.exception("Session claims for %d live round players failed; their scores not saved", len(others))
+    skipped = set(others) - claimed
+    for user_id, (correct, answered, user) in players.items():
+        if user_id in skipped:
+            metrics.incr("live_score_skipped")
+            continue
+        s = SCORES.setdefault(user_id, {"correct": 0, "total": 0})
+        s["correct"] += correct
+        s["total"] += answered
+        STATE.touch(user_id)
+        submit_final_score(guild_id, user, *get_score(user_id))
+    for user_id in claimed:
+        STATE.end_session(user_id)
 
 
 # ---------------- Commands ----------------
 @bot.command(name="quiz")
-async def quiz(ctx: commands.Context):
+async def quiz(ctx: commands.Context, *, how: str = ""):
+    """`!quiz` (in order), `!quiz random`, `!quiz topic:<name>`."""
     if ctx.author.id in ACTIVE_USERS:
         return await ctx.send(f"{ctx.author.mention} you already have a running quiz. Finish it or wait for it to time out.")
-    await start_quiz_in_thread(ctx)
+    how = how.strip()
+    if not how:
+        mode = "s"
+    elif how.lower() == "random":
+        mode = "r"
+    elif how.lower().startswith("topic:"):
+        await ensure_total_count()
+        topic = how[len("topic:"):].strip()
+        if not QUESTIONS.topic_offsets(topic):
+            topics = ", ".join(f"`{t}`" for t in QUESTIONS.topics) or "none"
+            return await ctx.send(f"❌ No questions for topic **{topic}**. Topics: {topics}"[:2000])
+        mode = topic_mode(topic)
+    else:
+        return await ctx.send("Usage: `!quiz`, `!quiz random` or `!quiz topic:<name>`")
+    await start_quiz_in_thread(ctx, mode)
+
+@bot.command(name="liveround")
+@commands.has_permissions(manage_messages=True)
+async def liveround(ctx: commands.Context, count: int | None = None, seconds: int | None = None, *, how: str = ""):
+    """Mod command: `!liveround [questions] [seconds] [topic:<name>]` — one shared quiz for the whole channel."""
+    # Both numbers are optional: a word where one is expected is left for `how`
+    if ctx.channel.id in LIVE_ROUNDS:
+        return await ctx.send("A live round is already running here.")
+    count = max(1, min(5 if count is None else count, LIVE_MAX_QUESTIONS))
+    seconds = max(LIVE_SECONDS[0], min(20 if seconds is None else seconds, LIVE_SECONDS[1]))
+    await ensure_total_count()
+    how = how.strip()
+    if how.lower().startswith("topic:"):
+        topic = how[len("topic:"):].strip()
+        pool = QUESTIONS.topic_offsets(topic)
+        if not pool:
+            topics = ", ".join(f"`{t}`" for t in QUESTIONS.topics) or "none"
+            return await ctx.send(f"❌ No questions for topic **{topic}**. Topics: {topics}"[:2000])
+    elif how:
+        return await ctx.send("Usage: `!liveround [questions] [seconds] [topic:<name>]`")
+    else:
+        pool = range(len(QUESTIONS))
+    await run_live_round(ctx, count, seconds, pool)
 
 @bot.command(name="score")
 async def score(ctx: commands.Context):
     corr, tot = get_score(ctx.author.id)
     await ctx.send(f"{ctx.author.mention} Your score: **{corr} / {tot}**")
 
+@bot.command(name="leaderboard")
+async def leaderboard(ctx: commands.Context, limit: int = 10):
+    """Top players in this server (served from memory)."""
+    limit = max(1, min(limit, 25))
+    gid = str(ctx.guild.id) if ctx.guild else "dm"
+    rows = LEADERBOARD_INDEX.top(gid, limit)
+    if not rows:
+        return await ctx.send("🏆 No scores yet — be the first with `!quiz`!")
+    lines = [f"**{i}.** {r['username']} — {r['correct']}/{r['total']}" for i, r in enumerate(rows, start=1)]
+    await ctx.send("🏆 **Leaderboard**\n" + "\n".join(lines))
+
+@bot.command(name="myrank")
+async def myrank(ctx: commands.Context):
+    gid = str(ctx.guild.id) if ctx.guild else "dm"
+    found = LEADERBOARD_INDEX.rank(gid, str(ctx.author.id))
+    if found is None:
+        return await ctx.send(f"{ctx.author.mention} you're not on the leaderboard yet. Finish a `!quiz` first!")
+    rank, players, row = found
+    await ctx.send(f"{ctx.author.mention} you're **#{rank}** of {players} ({row['correct']}/{row['total']}).")
+
 @bot.command(name="resetprogress")
 @commands.has_permissions(manage_messages=True)
 async def resetprogress(ctx: commands.Context, member: discord.Member | None = None):
-    """Admin/mod command: reset your or someone else's question pointer to 0."""
+    """Admin/mod command: reset your or someone else's question pointer to 0 (and what they've seen)."""
     target = member or ctx.author
-    PROGRESS[target.id] = 0
+    set_progress(target.id, 0)
+    STATE.seen.pop(target.id, None)
     await ctx.send(f"🔁 Progress reset for {target.mention}. Next question will be the first one.")
 
+@bot.command(name="reloadquestions")
+@commands.has_permissions(manage_messages=True)
+async def reloadquestions(ctx: commands.Context):
+    """Admin/mod command: reload the question bank from Supabase now."""
+    try:
+        await QUESTIONS.load()
+    except Exception as e:
+        logging.exception("Manual question reload failed")
+        return await ctx.send(f"❌ Reload failed: `{e}`")
+    await ctx.send(f"🔄 Reloaded **{len(QUESTIONS)}** questions ({QUESTIONS.skipped} skipped).")
+
+@bot.command(name="schemainfo")
+@commands.has_permissions(manage_messages=True)
+async def schemainfo(ctx: commands.Context):
+    """Admin/mod command: show how questions are being queried."""
+    await ctx.send(
+        f"🗂️ Query plan: **{QUESTIONS.describe_plan()}**\n"
+        f"Questions loaded: **{len(QUESTIONS)}** ({QUESTIONS.skipped} skipped, "
+        f"{QUESTIONS.synced} added by sync since the last full load)\n"
+        f"Probe fallbacks fired: **{QUESTIONS.fallbacks}**"
+    )
+
+@bot.command(name="stats")
+@commands.has_permissions(manage_messages=True)
+async def stats(ctx: commands.Context):
+    """Admin/mod command: show hot-path latencies and queue stats."""
+    lb = LEADERBOARD.stats()
+    lines = [
+        f"🚀 **Startup:** {startup_summary() or 'n/a'}" + ("" if is_ready() else " (not ready yet)"),
+        "",
+        "📊 **Leaderboard writer**",
+        f"Queue depth: **{lb['queue_depth']}** · rows written: {lb['rows_written']} "
+        f"in {lb['batches_written']} batches · coalesced: {lb['coalesced']} · failed attempts: {lb['failed_attempts']}",
+        f"Flush latency: last {lb['last_flush_ms']} ms · max {lb['max_flush_ms']} ms "
+        f"· spooled to disk: {lb['spooled']} · replayed: {lb['replayed']}",
+        "",
+    ]
+    br = BREAKER.stats()
+    lines += [
+        "🔌 **Supabase**",
+        f"Circuit: **{br['state']}** · opened {br['opened']}× · calls failed fast: {br['rejected']}"
+        + (" · ⚠️ serving questions from the local snapshot" if QUESTIONS.degraded else ""),
+        "",
+    ]
+    ob = OUTBOUND.stats()
+    lines += [
+        "📤 **Outbound messages**",
+        f"Queue depth: **{ob['queue_depth']}** · sent: {ob['sent']} · delayed: {ob['delayed']} "
+        f"· coalesced: {ob['coalesced']} · 429s: **{ob['rate_limited']}** · max wait: {ob['max_wait_ms']} ms",
+        "",
+    ]
+    if ANSWERS is not None:
+        ev = ANSWERS.stats()
+        lines += [
+            "📝 **Answer log**",
+            f"Buffered: **{ev['buffered']}** · recorded: {ev['recorded']} · written: {ev['written']} "
+            f"· uploaded: {ev['uploaded']} · failed uploads: {ev['upload_failures']}",
+            "",
+        ]
+    if not metrics.ENABLED:
+        lines.append("Latency metrics are off (set `METRICS=1`).")
+    else:
+        lines.append("⏱️ **Latency** (p50 / p95 / p99 ms, last samples)")
+        for name, count, p50, p95, p99 in metrics.summary():
+            lines.append(f"`{name}` ×{count}: {p50:.1f} / {p95:.1f} / {p99:.1f}")
+        for name, value in sorted(metrics.COUNTERS.items()):
+            lines.append(f"`{name}`: {value}")
+    await ctx.send("\n".join(lines)[:2000])
+
 # ---------------- Run ----------------
+_phase("imports", _T0)
+
 if __name__ == "__main__":
     if not TOKEN:
         raise SystemExit("Missing DISCORD_TOKEN in .env")
-    bot.run(TOKEN)
+
+    async def main():
+        global _LOGIN_T0
+        async with bot:
+            _LOGIN_T0 = time.perf_counter()
+            try:
+                await bot.start(TOKEN)
+            finally:
+                # Drain queued leaderboard rows / state before the process exits
+                await LEADERBOARD.close()
+                await STATE.close()
+                if ANSWERS is not None:
+                    await ANSWERS.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown_db()
@@ -0,0 +1,203 @@
+# db.py — async wrapper around the (synchronous) Supabase client
+#
+# The supabase-py client we use is blocking: every .execute() is a full HTTP
+# round trip on the calling thread. Calling it straight from a discord.py
+# handler freezes the event loop (other guilds' clicks, gateway heartbeats…).
+# Everything that talks to Supabase goes through run_db() instead, which hands
+# the call to a small, bounded thread pool and awaits the result.
+#
+# When Supabase stalls or errors, run_db() must not make every handler wait
+# for it: each call has a timeout (DB_TIMEOUT, or DB_BULK_TIMEOUT for
+# whole-table reads), and BREAKER, a circuit breaker, opens after
+# DB_BREAKER_FAILURES outages in a row. While it is open, calls fail at once
+# with DatabaseUnavailable. After DB_BREAKER_COOLDOWN seconds a single trial
+# call is let through and closes it again if it works. Callers fall back to
+# what they have locally (see QuestionStore's snapshot, LeaderboardWriter's spool).
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import metrics
+
+# How many Supabase requests may be in flight at once. httpx keeps its own
+# keep-alive pool underneath, so this is effectively the connection count.
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "8"))
+
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "5"))             # seconds for one call (claims, upserts, syncs…)
+DB_BULK_TIMEOUT = float(os.getenv("DB_BULK_TIMEOUT", "60"))  # seconds for a whole-table read
+
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="supabase")
+
+
+class DatabaseUnavailable(RuntimeError):
+    """Supabase timed out, or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int = 5, cooldown: float = 30.0):
+        self.failures = failures    # outages in a row that open the breaker
+        self.cooldown = cooldown    # seconds to stay open before a trial call
+        self._streak = 0
+        self._opened_at: float | None = None
+        self._trial = False         # a half-open trial call is in flight
+        self.opened = 0             # times it opened (stats)
+        self.rejected = 0           # calls failed fast while open (stats)
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half-open" if self._trial or time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if not self._trial and time.monotonic() - self._opened_at >= self.cooldown:
+            self._trial = True
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self):
+        """The trial call ended without an answer (cancelled): let the next call be the trial."""
+        self._trial = False
+
+    def success(self):
+        if self._opened_at is not None:
+            logging.info("Supabase reachable again; circuit closed")
+        self._streak = 0
+        self._opened_at = None
+        self._trial = False
+
+    def failure(self):
+        self._streak += 1
+        if self._trial or (self._opened_at is None and self._streak >= self.failures):
+            if self._opened_at is None:
+                self.opened += 1
+                logging.warning("Supabase failing (%d in a row); circuit open for %.0fs", self._streak, self.cooldown)
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "opened": self.opened, "rejected": self.rejected}
+
+
+BREAKER = CircuitBreaker(failures=int(os.getenv("DB_BREAKER_FAILURES", "5")),
+                         cooldown=float(os.getenv("DB_BREAKER_COOLDOWN", "30")))
+
+
+# PostgREST's own "database unreachable" errors (503/504): can't connect,
+# connection lost, schema cache not loaded, pool timeout
+_OUTAGE_CODES = {"PGRST000", "PGRST001", "PGRST002", "PGRST003"}
+# Postgres SQLSTATE classes meaning "not now" rather than "bad query":
+# 08 connection exception, 53 insufficient resources, 57 operator intervention
+_OUTAGE_SQLSTATE_CLASSES = ("08", "53", "57")
+
+
+def _from_database(e: Exception) -> bool:
+    """True if Supabase answered with this error (as opposed to it being raised on our side)."""
+    # Both are loaded by the time a Supabase call has failed
+    from postgrest.exceptions import APIError
+    return isinstance(e, APIError) or isinstance(getattr(getattr(e, "response", None), "status_code", None), int)
+
+
+def is_outage(e: Exception) -> bool:
+    # Only "can't reach the database right now" counts against the breaker:
+    # DatabaseUnavailable, httpx connection errors and timeouts, 5xx responses
+    # and PostgREST's connection errors. A bad request (bad column, unique
+    # violation, …) means the database answered, and anything else — a
+    # KeyError or TypeError from a bug — is not an outage at all.
+    if isinstance(e, DatabaseUnavailable):
+        return True
+    import httpx
+    if isinstance(e, httpx.TransportError):   # includes httpx.TimeoutException
+        return True
+    if not _from_database(e):
+        return False
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status >= 500
+    code = str(e.code or "")
+    if not code:
+        return True   # an error body without a PostgREST code: the gateway in front of it (a 502/503 page)
+    if code in _OUTAGE_CODES:
+        return True
+    if len(code) == 3 and code.isdigit():   # an HTTP status passed through as the code
+        return code >= "500"
+    return len(code) == 5 and code.startswith(_OUTAGE_SQLSTATE_CLASSES)
+
+
+async def run_db(fn, *args, timeout: float | None = None, **kwargs):
+    """Run a blocking Supabase call in the DB pool and await its result (at most `timeout` s)."""
+    if not BREAKER.allow():
+        metrics.incr("db_short_circuit")
+        raise DatabaseUnavailable("Supabase circuit breaker is open")
+    trial = BREAKER.state == "half-open"   # allow() just made this call the trial
+    loop = asyncio.get_running_loop()
+    timeout = DB_TIMEOUT if timeout is None else timeout
+    try:
+        # The pool thread may keep waiting on the socket after we give up;
+        # the httpx timeout set in LazyClient ends it eventually.
+        result = await asyncio.wait_for(loop.run_in_executor(_executor, partial(fn, *args, **kwargs)), timeout)
+    except asyncio.TimeoutError:
+        BREAKER.failure()
+        metrics.incr("db_timeout")
+        raise DatabaseUnavailable(f"Supabase call timed out after {timeout:g}s") from None
+    except Exception as e:
+        if is_outage(e):
+            BREAKER.failure()
+            metrics.incr("db_error")
+        elif _from_database(e):
+            BREAKER.success()   # it answered; the request was wrong
+        elif trial:
+            BREAKER.release()   # raised on our side before any answer: no verdict either way
+        raise
+    except BaseException:
+        # Cancelled before we learned anything; a trial left pending would keep
+        # the breaker half-open (and every later call rejected) forever
+        if trial:
+            BREAKER.release()
+        raise
+    BREAKER.success()
+    return result
+
+
+class LazyClient:
+    """
+    Stands in for supabase.create_client(url, key), but only imports supabase
+    (httpx, postgrest, … a good part of the bot's import time) and builds the
+    real client on first use — normally on a DB pool thread while the bot is
+    still connecting to Discord, instead of before it can even log in.
+    """
+
+    def __init__(self, url: str, key: str):
+        self.url = url
+        self.key = key
+        self._client = None
+        self._lock = threading.Lock()   # first use can come from several pool threads at once
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from supabase import ClientOptions, create_client
+                    # httpx's own per-request timeout (default 120 s), so a stalled
+                    # request also frees its pool thread; a bit over DB_TIMEOUT so
+                    # run_db's timeout is the one that fires first
+                    options = ClientOptions(postgrest_client_timeout=DB_TIMEOUT + 1)
+                    self._client = create_client(self.url, self.key, options=options)
+        return self._client
+
+    def __getattr__(self, name):
+        # client.table(...), client.rpc(...), … go to the real client
+        return getattr(self.get(), name)
+
+
+def shutdown_db():
+    """Stop accepting new DB work (pending calls are left to finish)."""
+    _executor.shutdown(wait=False)
@@ -0,0 +1,188 @@
+# events.py — append-only log of every answer, for question-difficulty analytics
+#
+# AnswerButton / SkipButton call ANSWERS.record(...), which only appends a
+# tuple to a list. A background task writes the buffer every few seconds to
+# the current file in ANSWER_LOG_DIR (JSON Lines: one header line naming the
+# fields, then one array per answer) and starts a new file once it is big or
+# old enough. Finished files can be bulk-uploaded to Supabase in batches;
+# uploaded files move to ANSWER_LOG_DIR/uploaded/.
+#
+# answer_stats.py reads these files to compute per-question accuracy.
+
+import asyncio
+import glob
+import itertools
+import json
+import logging
+import os
+import time
+
+from db import BREAKER, run_db
+
+FIELDS = ("id", "ts", "user_id", "guild_id", "question_id", "question_offset",
+          "choice", "correct", "latency_ms")
+
+
+def read_events(paths: list[str]):
+    """Yield event rows (lists in FIELDS order) from answer-log files, one line at a time."""
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            header = f.readline()
+            if not header or tuple(json.loads(header).get("fields", ())) != FIELDS:
+                logging.warning("Skipping %s: not an answer log", path)
+                continue
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def log_files(directory: str) -> list[str]:
+    """Every answer-log file under `directory`, uploaded or not, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, "**", "answers-*.jsonl"), recursive=True),
+                  key=os.path.basename)
+
+
+class AnswerLog:
+    def __init__(self, directory: str, client=None, table: str = "answer_events",
+                 flush_interval: float = 2.0, rotate_bytes: int = 16 << 20, rotate_seconds: float = 3600,
+                 upload_batch: int = 500):
+        self.directory = directory
+        self._client = client                 # None = keep files locally, don't upload
+        self.table = table
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.upload_batch = upload_batch
+
+        self._buffer: list[tuple] = []
+        self._ids = itertools.count()
+        self._prefix = f"{os.getpid():x}-{time.time_ns():x}"   # event ids: unique per process run
+        self._current: str | None = None
+        self._files = itertools.count()
+        self._opened_at = 0.0
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self._wakeup = asyncio.Event()
+
+        # stats
+        self.recorded = 0
+        self.written = 0
+        self.uploaded = 0
+        self.upload_failures = 0
+
+    # ----- producer side (called from handlers) -----
+
+    def record(self, user_id: int, guild_id: int | None, question: dict, offset: int,
+               choice: int | None, correct: bool, latency: float | None):
+        """Queue one answer (choice None = skipped). O(1); nothing is written here."""
+        self._buffer.append((
+            f"{self._prefix}-{next(self._ids):x}", round(time.time(), 3), user_id, guild_id,
+            question.get("id"), offset, choice, correct,
+            None if latency is None else int(latency * 1000),
+        ))
+        self.recorded += 1
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    # ----- lifecycle -----
+
+    def start(self):
+        if self._task is None:
+            os.makedirs(os.path.join(self.directory, "uploaded"), exist_ok=True)
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Write whatever is buffered and close the current file (upload is left for next start)."""
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        self._current = None
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                if self._client is not None and BREAKER.state != "open":
+                    await self.upload_finished()
+            except Exception:
+                logging.exception("Answer log flush/upload failed")
+
+    # ----- files -----
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._append_sync, batch)
+        except Exception:
+            self._buffer[:0] = batch   # keep them for the next try, in order
+            raise
+        self.written += len(batch)
+
+    def _append_sync(self, batch: list[tuple]):
+        now = time.time()
+        if (self._current is None or now - self._opened_at >= self.rotate_seconds
+                or os.path.getsize(self._current) >= self.rotate_bytes):
+            os.makedirs(self.directory, exist_ok=True)
+            self._current = os.path.join(
+                self.directory, f"answers-{time.strftime('%Y%m%d-%H%M%S', time.gmtime(now))}-{self._prefix}-{next(self._files):04d}.jsonl")
+            self._opened_at = now
+            with open(self._current, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"fields": FIELDS}) + "\n")
+        with open(self._current, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(e, separators=(",", ":")) + "\n" for e in batch)
+
+    # ----- upload -----
+
+    async def upload_finished(self):
+        """Upload every closed, not-yet-uploaded file, then move it to uploaded/."""
+        # Globbing, reading and moving files all happen in a worker thread, and
+        # a file is read one batch at a time, so a 16 MiB log never sits in memory whole
+        for path in await asyncio.to_thread(self._finished_files):
+            batches = self._batches(path)
+            sent = 0
+            try:
+                while (rows := await asyncio.to_thread(next, batches, None)) is not None:
+                    try:
+                        # Upsert on the event id, so re-sending part of a file after a failure is harmless
+                        query = self._client.table(self.table).upsert(rows, on_conflict="id")
+                        await run_db(query.execute)
+                    except Exception:
+                        self.upload_failures += 1
+                        logging.warning("Answer upload of %s failed; will retry", path, exc_info=True)
+                        return
+                    sent += len(rows)
+            finally:
+                batches.close()   # closes the file if we stopped halfway
+            await asyncio.to_thread(os.replace, path, os.path.join(self.directory, "uploaded", os.path.basename(path)))
+            self.uploaded += sent
+
+    def _finished_files(self) -> list[str]:
+        return [p for p in sorted(glob.glob(os.path.join(self.directory, "answers-*.jsonl"))) if p != self._current]
+
+    def _batches(self, path: str):
+        """Yield the file's events as lists of upload rows, upload_batch at a time."""
+        events = read_events([path])
+        while batch := [dict(zip(FIELDS, e)) for e in itertools.islice(events, self.upload_batch)]:
+            yield batch
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self.buffered,
+            "recorded": self.recorded,
+            "written": self.written,
+            "uploaded": self.uploaded,
+            "upload_failures": self.upload_failures,
+        }
@@ -0,0 +1,247 @@
+# fake_postgrest.py — a tiny local stand-in for Supabase's PostgREST API
+#
+# Just enough of PostgREST for what the bot does: select with eq/gt/lt/or
+# filters, order, offset/limit and count=exact; insert / upsert
+# (merge-duplicates on on_conflict columns); update; delete. Tables live in
+# memory. Point SUPABASE_URL at .url and the real supabase client talks to it.
+#
+# Used by bench.py. Latency and failures can be dialled in (and changed while
+# running) to see how the bot behaves when the database is slow or flaky:
+#
+#   pg = FakePostgrest({"questions": rows}, unique={"leaderboard": ("guild_id", "user_id")})
+#   pg.start()
+#   pg.latency = 0.05      # every request takes ≥ 50 ms
+#   pg.error_rate = 0.2    # 20% of requests fail with 503
+#   pg.stalled = True      # requests hang until set back to False (a brownout)
+
+import asyncio
+import json
+import random
+import re
+import threading
+from urllib.parse import unquote
+
+from aiohttp import web
+
+_OPS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+}
+_RESERVED = {"select", "order", "offset", "limit", "on_conflict", "columns", "or"}
+# One clause of an or=(…) list: commas inside "double quotes" don't split
+_OR_CLAUSE = re.compile(r'(?:[^,"]|"(?:\\.|[^"\\])*")+')
+
+
+class _BadRequest(Exception):
+    pass
+
+
+def _coerce(raw: str, like):
+    """Turn a filter value from the URL into the type stored in the row."""
+    if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+        raw = re.sub(r"\\(.)", r"\1", raw[1:-1])
+    if isinstance(like, bool):
+        return raw == "true"
+    if isinstance(like, int):
+        return int(float(raw))
+    if isinstance(like, float):
+        return float(raw)
+    return raw
+
+
+class FakePostgrest:
+    def __init__(self, tables: dict[str, list[dict]] | None = None,
+                 unique: dict[str, tuple[str, ...]] | None = None,
+                 columns: dict[str, set[str]] | None = None,
+                 latency: float = 0.0, error_rate: float = 0.0):
+        self.tables: dict[str, list[dict]] = {k: list(v) for k, v in (tables or {}).items()}
+        self.unique = unique or {}       # {table: columns forming the unique key}
+        self.columns = columns or {}     # {table: known columns}; inferred from rows otherwise
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stalled = False             # True = hold every request until un-stalled
+        self.requests = 0
+        self._next_id: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    # ----- lifecycle (runs its own event loop in a daemon thread) -----
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start_server(host, port))
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-postgrest", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.url
+
+    async def _start_server(self, host: str, port: int):
+        app = web.Application()
+        app.router.add_route("*", "/rest/v1/{table}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        real_port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{real_port}"
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    # ----- request handling -----
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        body = await request.text()   # before stalling: the client may hang up meanwhile
+        while self.stalled:
+            await asyncio.sleep(0.05)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return web.json_response({"message": "injected failure"}, status=503)
+
+        table = request.match_info["table"]
+        try:
+            with self._lock:
+                if request.method == "GET":
+                    return self._select(table, request)
+                if request.method == "POST":
+                    return self._insert(table, request, json.loads(body) if body else [])
+                if request.method == "PATCH":
+                    return self._update(table, request, json.loads(body) if body else {})
+                if request.method == "DELETE":
+                    return self._delete(table, request)
+        except _BadRequest as e:
+            return web.json_response({"message": str(e), "code": "42703"}, status=400)
+        return web.json_response({"message": "method not allowed"}, status=405)
+
+    def _known_columns(self, table: str) -> set[str]:
+        cols = set(self.columns.get(table, ()))
+        for row in self.tables.get(table, [])[:1]:
+            cols |= row.keys()
+        return cols
+
+    def _check_column(self, table: str, col: str):
+        known = self._known_columns(table)
+        if known and col not in known:
+            raise _BadRequest(f"column {table}.{col} does not exist")
+
+    def _parse_condition(self, table: str, col: str, expr: str):
+        self._check_column(table, col)
+        op, _, raw = expr.partition(".")
+        if op == "not":
+            cond = self._parse_condition(table, col, raw)
+            return lambda row: not cond(row)
+        if op == "is":
+            return lambda row: row.get(col) is None if raw == "null" else row.get(col) == (raw == "true")
+        if op == "in":
+            values = _OR_CLAUSE.findall(raw.strip("()"))
+            return lambda row: row.get(col) in {_coerce(v, row.get(col)) for v in values}
+        if op not in _OPS:
+            raise _BadRequest(f"unsupported operator {op}")
+        fn = _OPS[op]
+        return lambda row: fn(row.get(col), _coerce(raw, row.get(col)))
+
+    def _filters(self, table: str, request: web.Request):
+        conds = []
+        for key, value in request.query.items():
+            if key == "or":
+                parts = []
+                for clause in _OR_CLAUSE.findall(unquote(value).strip("()")):
+                    col, _, expr = clause.partition(".")
+                    parts.append(self._parse_condition(table, col, expr))
+                conds.append(lambda row, parts=parts: any(p(row) for p in parts))
+            elif key not in _RESERVED:
+                conds.append(self._parse_condition(table, key, value))
+        return lambda row: all(c(row) for c in conds)
+
+    def _select(self, table: str, request: web.Request) -> web.Response:
+        match = self._filters(table, request)
+        rows = [r for r in self.tables.get(table, []) if match(r)]
+        for spec in reversed(request.query.get("order", "").split(",")):
+            if not spec:
+                continue
+            col, _, direction = spec.partition(".")
+            self._check_column(table, col)
+            rows.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=direction.startswith("desc"))
+        total = len(rows)
+        start = int(request.query.get("offset", 0))
+        if "limit" in request.query:
+            rows = rows[start:start + int(request.query["limit"])]
+        else:
+            rows = rows[start:]
+        select = request.query.get("select", "*")
+        if select != "*":
+            wanted = [c.strip() for c in select.split(",")]
+            rows = [{c: r.get(c) for c in wanted} for r in rows]
+        headers = {}
+        if "count=exact" in request.headers.get("Prefer", ""):
+            end = start + len(rows) - 1
+            headers["Content-Range"] = f"{start}-{end}/{total}" if rows else f"*/{total}"
+        return web.json_response(rows, headers=headers)
+
+    def _insert(self, table: str, request: web.Request, payload) -> web.Response:
+        rows = payload if isinstance(payload, list) else [payload]
+        prefer = request.headers.get("Prefer", "")
+        upsert = "merge-duplicates" in prefer
+        ignore = "ignore-duplicates" in prefer
+        key_cols = tuple(request.query["on_conflict"].split(",")) if "on_conflict" in request.query \
+            else self.unique.get(table, ())
+        data = self.tables.setdefault(table, [])
+        index = {tuple(r.get(c) for c in key_cols): r for r in data} if key_cols else {}
+        out = []
+        for row in rows:
+            key = tuple(row.get(c) for c in key_cols)
+            existing = index.get(key) if key_cols else None
+            if existing is not None:
+                if ignore:
+                    continue   # ON CONFLICT DO NOTHING: not returned either
+                if not upsert:
+                    return web.json_response({"message": "duplicate key value", "code": "23505"}, status=409)
+                existing.update(row)
+                out.append(existing)
+                continue
+            new = dict(row)
+            if "id" not in new:
+                self._next_id[table] = self._next_id.get(table, len(data)) + 1
+                new["id"] = self._next_id[table]
+            data.append(new)
+            if key_cols:
+                index[key] = new
+            out.append(new)
+        return web.json_response(out, status=201)
+
+    def _update(self, table: str, request: web.Request, changes: dict) -> web.Response:
+        match = self._filters(table, request)
+        out = []
+        for row in self.tables.get(table, []):
+            if match(row):
+                row.update(changes)
+                out.append(row)
+        return web.json_response(out)
+
+    def _delete(self, table: str, request: web.Request) -> web.Response:
+        match = self._filters(table, request)
+        data = self.tables.get(table, [])
+        gone = [r for r in data if match(r)]
+        self.tables[table] = [r for r in data if not match(r)]
+        return web.json_response(gone)
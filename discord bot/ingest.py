@@ -0,0 +1,93 @@
+# ingest.py — validate the question bank offline and write a precompiled copy
+#
+#   py ingest.py                              # read the Supabase `questions` table
+#   py ingest.py --csv questions.csv          # …or a CSV export / hand-written sheet
+#   py ingest.py --check                      # only report bad rows, write nothing
+#
+# Rows are streamed (one page / one CSV line at a time) through the same
+# normalisation the bot uses; every bad row is reported with its id or line
+# number. The good ones are written to question_bank.json with the prompt,
+# choices, answer index and embed text already built. Start the bot with
+# QUESTION_BANK=question_bank.json to load that file instead of the table.
+#
+# CSV columns match the table: title, body, options (JSON), answer_key,
+# explanation, topic, kind. Instead of `options` you may use one column per
+# choice named A, B, C, … Rows whose `kind` is set to something other than
+# "mcq" are ignored.
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+
+from questions import QuestionStore, compile_question, write_bank
+
+
+def csv_rows(path: str):
+    """Yield (line number, row) from a CSV file, one at a time."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            if "options" not in row:
+                letters = sorted(k for k in row if k and len(k) == 1 and k.isupper() and row[k])
+                row["options"] = json.dumps([{"id": k, "text": row[k]} for k in letters])
+            yield reader.line_num, row
+
+
+def table_rows(page_size: int):
+    """Yield (row id, row) from the Supabase `questions` table, page by page."""
+    from supabase import create_client
+
+    load_dotenv()
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE") or os.getenv("SUPABASE_ANON_KEY")
+    if not url or not key:
+        raise SystemExit("Missing SUPABASE_URL and/or SUPABASE_SERVICE_ROLE (or SUPABASE_ANON_KEY) in .env")
+    store = QuestionStore(create_client(url, key), page_size=page_size)
+    for page in store.iter_pages_sync():
+        for row in page:
+            yield row.get("id"), row
+    print(f"Query plan: {store.describe_plan()}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate questions and write a precompiled question bank.")
+    parser.add_argument("--csv", help="read this CSV file instead of the Supabase table")
+    parser.add_argument("--out", default="question_bank.json", help="bank file to write (default: %(default)s)")
+    parser.add_argument("--check", action="store_true", help="validate only; don't write a bank")
+    parser.add_argument("--strict", action="store_true", help="exit with status 1 if any row is bad")
+    parser.add_argument("--page-size", type=int, default=1000, help="rows per page when reading the table")
+    args = parser.parse_args()
+
+    if args.csv:
+        source, rows, where = args.csv, csv_rows(args.csv), "line"
+    else:
+        source, rows, where = "supabase:questions", table_rows(args.page_size), "id"
+
+    questions: list[dict] = []
+    bad = ignored = 0
+    for ref, row in rows:
+        if row.get("kind") and row["kind"] != "mcq":
+            ignored += 1
+            continue
+        try:
+            questions.append(compile_question(row))
+        except (RuntimeError, TypeError, ValueError) as e:   # report the row, keep going
+            bad += 1
+            print(f"  bad row ({where} {ref}): {e}", file=sys.stderr)
+
+    print(f"{len(questions)} good, {bad} bad, {ignored} ignored (not mcq) from {source}", file=sys.stderr)
+    if not args.check:
+        if not questions:
+            raise SystemExit("No valid questions; not writing an empty bank.")
+        write_bank(args.out, questions, source)
+        print(f"Wrote {args.out}", file=sys.stderr)
+    if bad and args.strict:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
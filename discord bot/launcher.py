@@ -0,0 +1,68 @@
+# launcher.py — run the bot as N worker processes, each owning a slice of shards
+#
+#   py launcher.py --workers 4 --shard-count 16      # 4 processes × 4 shards
+#   py launcher.py --shard-count 8 --shard-ids 0,1   # just this process's shards
+#
+# Workers share scores/progress/active sessions through the state backend
+# (STATE_BACKEND=sqlite on one host, or supabase across hosts), so a user
+# can't hold two sessions at once. Each worker keeps its own read-only copy of
+# the question bank.
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def shard_slices(shard_count: int, workers: int) -> list[list[int]]:
+    """Round-robin shards over workers: 8 shards / 3 workers → [0,3,6] [1,4,7] [2,5]."""
+    return [list(range(w, shard_count, workers)) for w in range(workers)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the quiz bot sharded over several processes.")
+    parser.add_argument("--shard-count", type=int, required=True, help="total number of shards")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes to start")
+    parser.add_argument("--shard-ids", help="comma-separated shards for a single worker (skips --workers)")
+    args = parser.parse_args()
+
+    if args.shard_ids:
+        slices = [[int(i) for i in args.shard_ids.split(",")]]
+    else:
+        if not 1 <= args.workers <= args.shard_count:
+            parser.error("--workers must be between 1 and --shard-count")
+        slices = shard_slices(args.shard_count, args.workers)
+
+    procs: list[subprocess.Popen] = []
+    for ids in slices:
+        env = dict(os.environ, SHARD_COUNT=str(args.shard_count), SHARD_IDS=",".join(map(str, ids)))
+        print(f"Starting worker for shards {ids}", flush=True)
+        procs.append(subprocess.Popen([sys.executable, "bot.py"], cwd=BOT_DIR, env=env))
+
+    def _stop(signum, frame):
+        for p in procs:
+            if p.poll() is None:
+                p.send_signal(signal.SIGINT)
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    # If any worker dies, take the rest down too so the orchestrator restarts us cleanly
+    exit_code = None
+    while True:
+        codes = [p.poll() for p in procs]  # poll every worker each tick, not just up to the first live one
+        if all(code is not None for code in codes):
+            break
+        if exit_code is None and any(code is not None for code in codes):
+            exit_code = next(code for code in codes if code is not None)
+            _stop(None, None)
+        time.sleep(1)
+    sys.exit(exit_code or max(codes, default=0))
+
+
+if __name__ == "__main__":
+    main()
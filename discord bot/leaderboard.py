@@ -0,0 +1,272 @@
+# leaderboard.py — write-behind leaderboard submission
+#
+# Finishing a quiz used to run one synchronous upsert inside the button
+# handler. Now handlers just drop the row into LeaderboardWriter, which keeps
+# only the latest row per (guild_id, user_id) and upserts them in batches from
+# a background task (on a size or time threshold, with retry + backoff).
+# Rows that still can't be written (Supabase down, circuit breaker open) are
+# appended to a spool file on disk, and replayed once Supabase answers again —
+# also after a restart.
+#
+# LeaderboardIndex is the read side: an in-process, per-guild sorted copy of
+# the table, updated on every submit and fully resynced only now and then, so
+# !leaderboard and !myrank never need a database round trip.
+
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+import metrics
+from db import BREAKER, DB_BULK_TIMEOUT, DatabaseUnavailable, run_db
+
+
+class LeaderboardWriter:
+    def __init__(self, client, table: str = "leaderboard", batch_size: int = 50,
+                 flush_interval: float = 2.0, max_retries: int = 5, backoff: float = 0.5,
+                 spool_path: str | None = None):
+        self._client = client
+        self.table = table
+        self.spool_path = spool_path   # None = keep failed rows in memory only
+        self._replay_at = 0.0          # don't re-read the spool before this (monotonic)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self._pending: dict[tuple[str, str], dict] = {}   # {(guild_id, user_id): latest row}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+        # stats
+        self.rows_written = 0
+        self.batches_written = 0
+        self.failed_attempts = 0
+        self.coalesced = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    # ----- producer side (called from handlers) -----
+
+    def submit(self, row: dict):
+        """Queue a leaderboard row. O(1); replaces any unsent row for the same user."""
+        key = (row["guild_id"], row["user_id"])
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = row
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def pending_rows(self) -> list[dict]:
+        """Rows accepted but not yet written (newer than anything in the table)."""
+        rows = {(r["guild_id"], r["user_id"]): r for r in self._read_spool_sync()}
+        rows.update(self._pending)
+        return list(rows.values())
+
+    # ----- lifecycle -----
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the background task and drain whatever is still queued."""
+        if self._task is not None:
+            # Ask the loop to finish rather than cancelling it: cancelling a task
+            # inside wait_for() can be swallowed when the event fires at the same time.
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Leaderboard flush failed")
+
+    # ----- consumer side -----
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not await self._drain():
+                return
+            # Supabase isn't known to be down (and didn't just fail us): bring the spool back
+            if (self.spool_path and BREAKER.state != "open" and time.monotonic() >= self._replay_at
+                    and os.path.exists(self.spool_path)):
+                await self._replay_spool()
+                await self._drain()
+
+    async def _drain(self) -> bool:
+        while self._pending:
+            keys = list(self._pending)[: self.batch_size]
+            batch = [self._pending.pop(k) for k in keys]
+            if not await self._write(batch):
+                # Put rows back unless a newer score arrived meanwhile; retry next tick.
+                for row in batch:
+                    self._pending.setdefault((row["guild_id"], row["user_id"]), row)
+                if self.spool_path:
+                    await self._spool(list(self._pending.values()))
+                    self._pending.clear()
+                    self._replay_at = time.monotonic() + BREAKER.cooldown
+                return False
+        return True
+
+    async def _spool(self, rows: list[dict]):
+        def append():
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(r) + "\n" for r in rows)
+                f.flush()
+                os.fsync(f.fileno())
+        await asyncio.to_thread(append)
+        self.spooled += len(rows)
+        logging.warning("Spooled %d leaderboard rows to %s for later", len(rows), self.spool_path)
+
+    def _read_spool_sync(self) -> list[dict]:
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return []
+        rows = []
+        with open(self.spool_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    pass  # torn last line from a crash mid-write
+        return rows
+
+    async def _replay_spool(self):
+        """Move spooled rows back into the queue (a newer queued row for the same user wins)."""
+        rows = await asyncio.to_thread(self._read_spool_sync)
+        await asyncio.to_thread(os.remove, self.spool_path)
+        latest = {(r["guild_id"], r["user_id"]): r for r in rows}   # later lines are newer
+        for key, row in latest.items():
+            self._pending.setdefault(key, row)
+        self.replayed += len(latest)
+        logging.info("Replaying %d spooled leaderboard rows", len(latest))
+
+    async def _write(self, batch: list[dict]) -> bool:
+        started = time.perf_counter()
+        for attempt in range(self.max_retries):
+            try:
+                query = self._client.table(self.table).upsert(batch, on_conflict="guild_id,user_id")
+                with metrics.timed("supabase_upsert"):
+                    await run_db(query.execute)
+            except Exception as e:
+                self.failed_attempts += 1
+                metrics.incr("supabase_upsert_error")
+                logging.warning("Leaderboard upsert of %d rows failed (attempt %d/%d)",
+                                len(batch), attempt + 1, self.max_retries, exc_info=True)
+                if isinstance(e, DatabaseUnavailable):
+                    return False  # timed out / breaker open: retrying right away won't help
+                if attempt + 1 < self.max_retries:
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+                continue
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+            self.rows_written += len(batch)
+            self.batches_written += 1
+            return True
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "rows_written": self.rows_written,
+            "batches_written": self.batches_written,
+            "coalesced": self.coalesced,
+            "failed_attempts": self.failed_attempts,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "last_flush_ms": round(self.last_flush_ms, 1),
+            "max_flush_ms": round(self.max_flush_ms, 1),
+        }
+
+
+def _rank_key(row: dict) -> tuple:
+    """Same order as the `leaderboard_rank` index: correct desc, total asc, submitted_at desc."""
+    try:
+        ts = datetime.fromisoformat(row["submitted_at"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        ts = 0.0
+    return (-int(row["correct"]), int(row["total"]), -ts, row["user_id"])
+
+
+class LeaderboardIndex:
+    def __init__(self, client, table: str = "leaderboard", page_size: int = 1000):
+        self._client = client
+        self.table = table
+        self.page_size = page_size
+        self._keys: dict[str, list[tuple]] = {}                  # {guild_id: sorted rank keys}
+        self._rows: dict[tuple[str, str], tuple[tuple, dict]] = {}  # {(guild_id, user_id): (key, row)}
+        self.synced_at: float | None = None
+
+    def update(self, row: dict):
+        """Insert or move one user's row. O(log n) search + list insert."""
+        gid, uid = row["guild_id"], row["user_id"]
+        keys = self._keys.setdefault(gid, [])
+        old = self._rows.get((gid, uid))
+        if old is not None:
+            i = bisect.bisect_left(keys, old[0])
+            if i < len(keys) and keys[i] == old[0]:
+                del keys[i]
+        key = _rank_key(row)
+        bisect.insort(keys, key)
+        self._rows[(gid, uid)] = (key, row)
+
+    def top(self, guild_id: str, limit: int = 10) -> list[dict]:
+        keys = self._keys.get(guild_id, [])
+        return [self._rows[(guild_id, k[3])][1] for k in keys[:limit]]
+
+    def rank(self, guild_id: str, user_id: str) -> tuple[int, int, dict] | None:
+        """(1-based rank, players in guild, row) or None if the user has no score."""
+        entry = self._rows.get((guild_id, user_id))
+        if entry is None:
+            return None
+        keys = self._keys[guild_id]
+        return bisect.bisect_left(keys, entry[0]) + 1, len(keys), entry[1]
+
+    async def resync(self):
+        """Rebuild everything from the table (run at startup and periodically)."""
+        rows = await run_db(self._fetch_all_sync, timeout=DB_BULK_TIMEOUT)
+        keys: dict[str, list[tuple]] = {}
+        by_user: dict[tuple[str, str], tuple[tuple, dict]] = {}
+        for row in rows:
+            key = _rank_key(row)
+            keys.setdefault(row["guild_id"], []).append(key)
+            by_user[(row["guild_id"], row["user_id"])] = (key, row)
+        for k in keys.values():
+            k.sort()
+        self._keys, self._rows = keys, by_user
+        self.synced_at = time.monotonic()
+        logging.info("Leaderboard index synced: %d rows, %d guilds", len(rows), len(keys))
+
+    def _fetch_all_sync(self) -> list[dict]:
+        rows: list[dict] = []
+        while True:
+            page = (self._client.table(self.table)
+                    .select("guild_id, user_id, username, correct, total, submitted_at")
+                    .order("id")
+                    .range(len(rows), len(rows) + self.page_size - 1)
+                    .execute().data or [])
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
@@ -0,0 +1,159 @@
+# metrics.py — lightweight timing histograms + counters for the hot path
+#
+#   with metrics.timed("fetch_question"):
+#       ...
+#   metrics.incr("forbidden_unarchive_retry")
+#
+# Off by default (METRICS=1 to enable). When off, timed() hands back one shared
+# no-op context manager and incr() returns immediately, so instrumented code
+# costs a function call and nothing else.
+#
+# render_prometheus() produces the Prometheus text format; serve() exposes it
+# on a local aiohttp server (aiohttp already ships with discord.py), next to
+# GET /ready for orchestrators (200 once the bot can serve quizzes, else 503).
+
+import os
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Callable
+
+ENABLED = os.getenv("METRICS", "0").lower() in ("1", "true", "yes")
+
+# Upper bounds (seconds) for the Prometheus buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Recent samples kept per histogram for the p50/p95/p99 shown by !stats
+WINDOW = 2048
+
+_NOOP = nullcontext()
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count", "recent")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+        self.recent: deque[float] = deque(maxlen=WINDOW)
+
+    def observe(self, seconds: float):
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+
+    def percentiles(self, *ps: float) -> list[float]:
+        """Percentiles (0–100) over the recent window, in seconds."""
+        data = sorted(self.recent)
+        if not data:
+            return [0.0 for _ in ps]
+        return [data[min(len(data) - 1, int(len(data) * p / 100))] for p in ps]
+
+
+class _Timer:
+    __slots__ = ("hist", "started")
+
+    def __init__(self, hist: Histogram):
+        self.hist = hist
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.started)
+        return False
+
+
+HISTOGRAMS: dict[str, Histogram] = {}
+COUNTERS: dict[str, int] = {}
+GAUGES: dict[str, Callable[[], float]] = {}   # {name: function read at scrape time}
+
+
+def timed(name: str):
+    """Context manager recording the block's wall time under `name`."""
+    if not ENABLED:
+        return _NOOP
+    hist = HISTOGRAMS.get(name)
+    if hist is None:
+        hist = HISTOGRAMS[name] = Histogram()
+    return _Timer(hist)
+
+
+def observe(name: str, seconds: float):
+    if not ENABLED:
+        return
+    hist = HISTOGRAMS.get(name)
+    if hist is None:
+        hist = HISTOGRAMS[name] = Histogram()
+    hist.observe(seconds)
+
+
+def incr(name: str, n: int = 1):
+    if not ENABLED:
+        return
+    COUNTERS[name] = COUNTERS.get(name, 0) + n
+
+
+def gauge(name: str, fn):
+    """Register a value that is read (by calling fn) whenever metrics are rendered."""
+    GAUGES[name] = fn
+
+
+def summary() -> list[tuple[str, int, float, float, float]]:
+    """[(name, count, p50_ms, p95_ms, p99_ms)] sorted by name."""
+    out = []
+    for name in sorted(HISTOGRAMS):
+        h = HISTOGRAMS[name]
+        p50, p95, p99 = h.percentiles(50, 95, 99)
+        out.append((name, h.count, p50 * 1000, p95 * 1000, p99 * 1000))
+    return out
+
+
+def render_prometheus(prefix: str = "dsquiz_") -> str:
+    lines = []
+    for name in sorted(COUNTERS):
+        metric = f"{prefix}{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {COUNTERS[name]}")
+    for name in sorted(GAUGES):
+        metric = f"{prefix}{name}"
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {GAUGES[name]()}")
+    for name in sorted(HISTOGRAMS):
+        h = HISTOGRAMS[name]
+        metric = f"{prefix}{name}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, c in zip(BUCKETS, h.counts):
+            cumulative += c
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {h.count}')
+        lines.append(f"{metric}_sum {h.total}")
+        lines.append(f"{metric}_count {h.count}")
+    return "\n".join(lines) + "\n"
+
+
+async def serve(host: str, port: int, ready: Callable[[], bool] = lambda: True):
+    """Start a tiny HTTP server exposing GET /metrics and GET /ready. Returns the aiohttp runner."""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=render_prometheus(), content_type="text/plain")
+
+    async def handle_ready(request):
+        if ready():
+            return web.Response(text="ready\n")
+        return web.Response(text="starting\n", status=503)
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/ready", handle_ready)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
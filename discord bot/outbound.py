@@ -0,0 +1,226 @@
+# outbound.py — rate-limit-aware scheduler for messages the bot sends
+#
+# discord.py only reacts to 429s after Discord sends them. OutboundScheduler
+# paces calls before that happens: every (route, channel) pair gets a token
+# bucket sized to Discord's documented limits, plus one global bucket. A call
+# that fits in its bucket runs right away; otherwise it waits in that bucket's
+# queue, highest priority first:
+#
+#   RESPONSE — follow-ups to a click the user is looking at
+#   NORMAL   — questions and other content
+#   LOW      — informational ("Session ended", archiving)
+#
+# Interaction callbacks (route "response") never wait: Discord wants them
+# within 3 seconds and doesn't count them against channel limits.
+#
+# Calls given the same `coalesce` key while still queued collapse into one:
+# the newest arguments win, the job runs at the most urgent priority any of
+# them asked for, and every caller gets that call's result. Only give two
+# calls the same key if either one may replace the other (e.g. put the
+# target state — archived=True vs False — in the key).
+#
+#   msg = await OUTBOUND.call("send", thread.id, thread.send, "hi", priority=LOW)
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+import metrics
+
+RESPONSE, NORMAL, LOW = 0, 1, 2
+
+# (requests, per seconds) for each route, per channel
+ROUTE_LIMITS = {
+    "send": (5, 5.0),       # POST /channels/{id}/messages
+    "edit": (5, 5.0),       # PATCH messages / the thread itself
+    "followup": (5, 5.0),   # POST /webhooks/{app}/{token}
+}
+# Bot-wide limit; interaction follow-ups are exempt from it
+GLOBAL_LIMIT = (50, 1.0)
+GLOBAL_ROUTES = {"send", "edit"}
+# Idle buckets are dropped once there are this many (a full idle bucket is the same as a new one)
+MAX_BUCKETS = 10_000
+
+
+class _Bucket:
+    __slots__ = ("rate", "per", "tokens", "updated", "queue", "worker", "is_global")
+
+    def __init__(self, rate: int, per: float, is_global: bool = False):
+        self.rate = rate
+        self.per = per
+        self.is_global = is_global   # also needs a token from the global bucket
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.queue: list[_Job] = []
+        self.worker: asyncio.Task | None = None
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is free (0 = now)."""
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) * self.per / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "fn", "args", "kwargs", "futures", "key", "queued_at")
+
+    def __init__(self, priority: int, seq: int, fn, args, kwargs, key):
+        self.priority = priority
+        self.seq = seq
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.futures: list[asyncio.Future] = []
+        self.key = key
+        self.queued_at = time.monotonic()
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _RateLimitLog(logging.Filter):
+    """Counts the 429s discord.py logs (it retries those itself)."""
+
+    def __init__(self, scheduler: "OutboundScheduler"):
+        super().__init__()
+        self.scheduler = scheduler
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if "429" in str(record.msg) or "rate limit" in str(record.msg):
+            self.scheduler.rate_limited += 1
+            metrics.incr("discord_429")
+        return True
+
+
+class OutboundScheduler:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._buckets: dict[tuple[str, int], _Bucket] = {}
+        self._global = _Bucket(*GLOBAL_LIMIT)
+        self._queued: dict[object, _Job] = {}   # {coalesce key: job still waiting}
+        self._seq = itertools.count()
+
+        # stats
+        self.sent = 0
+        self.delayed = 0
+        self.coalesced = 0
+        self.rate_limited = 0     # 429s seen (from discord.py's log or raised)
+        self.max_wait_ms = 0.0
+        logging.getLogger("discord.http").addFilter(_RateLimitLog(self))
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(b.queue) for b in self._buckets.values())
+
+    async def call(self, route: str, channel_id: int, fn, *args, priority: int = NORMAL,
+                   coalesce=None, **kwargs):
+        """Run fn(*args, **kwargs) once the (route, channel) bucket allows it; returns its result."""
+        if not self.enabled or route == "response":
+            return await self._run(fn, args, kwargs)
+
+        key = (route, channel_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._prune()
+            bucket = self._buckets[key] = _Bucket(*ROUTE_LIMITS[route], is_global=route in GLOBAL_ROUTES)
+
+        # Fast path: nothing queued ahead of us and both buckets have a token
+        now = time.monotonic()
+        if not bucket.queue and self._delay(bucket, now) == 0:
+            self._take(bucket)
+            return await self._run(fn, args, kwargs, bucket)
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        job = self._queued.get(coalesce) if coalesce is not None else None
+        if job is not None:
+            # Same target still waiting: keep its place in line, send the newest version
+            job.fn, job.args, job.kwargs = fn, args, kwargs
+            job.futures.append(fut)
+            if priority < job.priority:
+                job.priority = priority   # a more urgent caller is now waiting on it too
+                heapq.heapify(bucket.queue)
+            self.coalesced += 1
+        else:
+            job = _Job(priority, next(self._seq), fn, args, kwargs, coalesce)
+            job.futures.append(fut)
+            heapq.heappush(bucket.queue, job)
+            if coalesce is not None:
+                self._queued[coalesce] = job
+            self.delayed += 1
+            if bucket.worker is None:
+                bucket.worker = loop.create_task(self._drain(bucket))
+        return await fut
+
+    def _delay(self, bucket: _Bucket, now: float) -> float:
+        wait = bucket.delay(now)
+        return max(wait, self._global.delay(now)) if bucket.is_global else wait
+
+    def _take(self, bucket: _Bucket):
+        bucket.take()
+        if bucket.is_global:
+            self._global.take()
+
+    def _prune(self):
+        now = time.monotonic()
+        for key, b in list(self._buckets.items()):
+            if b.worker is None and not b.queue and b.delay(now) == 0 and b.tokens >= b.rate:
+                del self._buckets[key]
+
+    async def _drain(self, bucket: _Bucket):
+        try:
+            while bucket.queue:
+                now = time.monotonic()
+                wait = self._delay(bucket, now)
+                if wait:
+                    await asyncio.sleep(wait)
+                    continue
+                job = heapq.heappop(bucket.queue)
+                if job.key is not None:
+                    self._queued.pop(job.key, None)
+                self._take(bucket)
+                waited = (now - job.queued_at) * 1000
+                self.max_wait_ms = max(self.max_wait_ms, waited)
+                metrics.observe("outbound_queue_wait", waited / 1000)
+                try:
+                    result = await self._run(job.fn, job.args, job.kwargs, bucket)
+                except Exception as e:
+                    for f in job.futures:
+                        if not f.done():
+                            f.set_exception(e)
+                else:
+                    for f in job.futures:
+                        if not f.done():
+                            f.set_result(result)
+        finally:
+            bucket.worker = None
+
+    async def _run(self, fn, args, kwargs, bucket: _Bucket | None = None):
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            if getattr(e, "status", None) == 429:
+                # discord.py gave up retrying; back off this bucket entirely
+                self.rate_limited += 1
+                metrics.incr("discord_429")
+                if bucket is not None:
+                    bucket.tokens = 0
+            raise
+        self.sent += 1
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "sent": self.sent,
+            "delayed": self.delayed,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+        }
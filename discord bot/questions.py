@@ -0,0 +1,483 @@
+# questions.py — question normalisation + in-process question bank
+#
+# The whole `questions` table is small, so instead of one `range(offset, offset)`
+# query per "Yes" click we load it once, keep the already-normalised dicts in a
+# list indexed by offset, and serve lookups from memory. New questions are
+# picked up by sync(): it asks only for rows past the last one we have (by
+# published_at, id) and appends them, so publishing costs O(new rows). A
+# full reload still runs now and then to catch edits and deletions.
+#
+# Questions can also come from a precompiled bank file written by ingest.py
+# (QUESTION_BANK=question_bank.json). Those rows were validated and compiled
+# offline, so loading them does no parsing or normalisation at all.
+#
+# Every full load from the table also leaves a snapshot in that same format
+# (QUESTION_SNAPSHOT). If Supabase is down when the bot starts, the snapshot
+# is served instead ("degraded") until a load from the table works again.
+#
+# Shuffle gives each random-mode session its own question order without
+# building a shuffled list per user.
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+import metrics
+from db import DB_BULK_TIMEOUT, is_outage, run_db
+
+
+def normalize_question(row: dict) -> dict:
+    """
+    Your schema:
+      title (str) = question text
+      body (str)  = subtitle/extra text (optional)
+      options     = JSON array of {id: "A|B|C|D", text: "..."}
+      answer_key  = "A" | "B" | "C" | "D"
+    We convert to bot's canonical shape:
+      prompt, choices[list[str]], answer[int], explanation(str|""), topic(str|"")
+    """
+    # Question text
+    title = row.get("title")
+    body  = row.get("body") or ""
+    if not isinstance(title, str) or not title.strip():
+        raise RuntimeError("Missing 'title' for question.")
+
+    prompt = title.strip()
+    if body and isinstance(body, str) and body.strip():
+        prompt = f"{title.strip()}\n\n{body.strip()}"
+
+    # Options can be a JSON string or already a list
+    opts_raw = row.get("options")
+    if isinstance(opts_raw, str):
+        try:
+            options_list = json.loads(opts_raw)
+        except Exception:
+            raise RuntimeError("Could not parse 'options' JSON string.")
+    elif isinstance(opts_raw, list):
+        options_list = opts_raw
+    else:
+        raise RuntimeError("Invalid 'options' field; expected JSON string or list of objects.")
+    if not isinstance(options_list, list):
+        # e.g. options = "null" or "3": valid JSON, but not a list
+        raise RuntimeError("Invalid 'options' JSON; expected a list of objects.")
+
+    # Extract labels in A..D order as they appear
+    # Each option is like {"id":"A","text":"A programming language"}
+    if not all(isinstance(o, dict) and isinstance(o.get("text"), str) for o in options_list):
+        raise RuntimeError("Invalid options entries; expected objects with a 'text' string.")
+
+    choices = [o["text"] for o in options_list]
+
+    # Map answer_key ("A"/"B"/"C"/"D") to index by matching the option's id
+    answer_key = row.get("answer_key")
+    if isinstance(answer_key, str):
+        answer_key = answer_key.strip().upper()
+    else:
+        raise RuntimeError("Missing 'answer_key' (expected 'A'|'B'|'C'|'D').")
+
+    # Find the index of the option whose "id" matches answer_key
+    ids = [o.get("id") for o in options_list]
+    try:
+        answer_index = ids.index(answer_key)
+    except ValueError:
+        # Fallback: some data might store the answer text instead of the key
+        try:
+            answer_index = choices.index(answer_key)
+        except ValueError:
+            raise RuntimeError("answer_key not found in options id/text.")
+
+    if not (0 <= answer_index < len(choices)):
+        raise RuntimeError("Computed answer index is out of range.")
+
+    return {
+        "prompt": prompt,
+        "choices": choices,
+        "answer": answer_index,
+        "explanation": row.get("explanation") or "",
+        "topic": row.get("topic") or "",
+    }
+
+
+# Shown under every question in the embed
+EMBED_HINT = "\n\n*Click a button below to answer.*"
+
+# Field order of the rows in a bank file
+BANK_FORMAT = 2
+BANK_FIELDS = ("id", "prompt", "choices", "answer", "explanation", "topic", "description")
+
+
+def compile_question(row: dict) -> dict:
+    """normalize_question() plus everything the hot path would otherwise rebuild per send."""
+    q = normalize_question(row)
+    q["id"] = int(row["id"]) if str(row.get("id") or "").isdigit() else None   # for answer analytics
+    q["choices"] = tuple(q["choices"])
+    q["description"] = q["prompt"] + EMBED_HINT
+    return q
+
+
+def write_bank(path: str, questions: list[dict], source: str):
+    """Write compiled questions to `path` (atomically: temp file + rename)."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({
+            "format": BANK_FORMAT,
+            "source": source,
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "fields": BANK_FIELDS,
+            "questions": [[q[k] for k in BANK_FIELDS] for q in questions],
+        }, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def read_bank(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        bank = json.load(f)
+    if bank.get("format") != BANK_FORMAT or tuple(bank.get("fields", ())) != BANK_FIELDS:
+        raise RuntimeError(f"{path} was written by a different ingest.py version; rebuild it.")
+    return [
+        {"id": i, "prompt": p, "choices": tuple(c), "answer": a, "explanation": e, "topic": t, "description": d}
+        for i, p, c, a, e, t, d in bank["questions"]
+    ]
+
+
+class Shuffle:
+    """
+    A random order over `pool` (a list/range of offsets), generated lazily.
+
+    Position i maps to pool[perm(i)], where perm is a small keyed Feistel
+    network over the next power-of-4 domain, cycle-walked back into range —
+    a true permutation, so every offset comes up exactly once. State is one
+    key and a cursor, whatever the size of the pool.
+    """
+    __slots__ = ("pool", "n", "key", "i", "_half", "_mask")
+
+    ROUNDS = 4
+
+    def __init__(self, pool, rng: random.Random | None = None):
+        self.pool = pool
+        self.n = len(pool)   # fixed: the pool may grow (sync) while we're using it
+        self.key = (rng or random).getrandbits(64)
+        self.i = 0
+        half = 1
+        while 1 << (2 * half) < self.n:
+            half += 1
+        self._half = half
+        self._mask = (1 << half) - 1
+
+    def _perm(self, i: int) -> int:
+        n, half, mask = self.n, self._half, self._mask
+        x = i
+        while True:
+            left, right = x >> half, x & mask
+            for r in range(self.ROUNDS):
+                left, right = right, left ^ (hash((self.key, r, right)) & mask)
+            x = (left << half) | right
+            if x < n:
+                return x
+
+    def next(self, seen: int = 0) -> int | None:
+        """Next offset whose bit is not set in `seen`; None once the pool is used up."""
+        while self.i < self.n:
+            offset = self.pool[self._perm(self.i)]
+            self.i += 1
+            if not seen >> offset & 1:
+                return offset
+        return None
+
+    def peek(self, seen: int, k: int) -> list[int]:
+        """The next `k` offsets next() would return, without moving."""
+        out: list[int] = []
+        i = self.i
+        while len(out) < k and i < self.n:
+            offset = self.pool[self._perm(i)]
+            i += 1
+            if not seen >> offset & 1:
+                out.append(offset)
+        return out
+
+
+class QuestionStore:
+    """
+    Offset-indexed, already-normalised copy of the `questions` table.
+
+    Order matches what fetch-by-offset used to return: kind='mcq' rows first if
+    that filter works, ordered by published_at (then id), falling back to id.
+    Rows that fail normalize_question() are skipped (and logged) at load time,
+    so a bad row can never reach a user mid-quiz.
+
+    With `bank_path` set the table is not queried at all; the precompiled bank
+    file is read instead. `snapshot_path` is the fallback copy described above.
+    """
+
+    # (filter kind='mcq', order by published_at) in the order we try them
+    QUERY_PLANS = [(True, True), (True, False), (False, True), (False, False)]
+
+    def __init__(self, client, table: str = "questions", page_size: int = 1000, ttl: float = 3600,
+                 bank_path: str | None = None, sync_interval: float = 30, snapshot_path: str | None = None):
+        self._client = client
+        self.table = table
+        self.bank_path = bank_path
+        self.snapshot_path = snapshot_path
+        self.page_size = page_size
+        self.ttl = ttl                        # seconds between full reloads
+        self.sync_interval = sync_interval    # seconds between incremental syncs (0 = off)
+        self._questions: list[dict] = []
+        self._topics: dict[str, list[int]] = {}   # {lowercased topic: offsets}
+        self._lock = asyncio.Lock()
+        self.loaded_at: float | None = None   # time.monotonic() of the last successful load
+        self.skipped = 0                       # rows dropped by the last load
+        self.plan: tuple[bool, bool] | None = None  # (with_kind, order_by_published) that works here
+        self.fallbacks = 0                     # query variants that failed/came back empty while probing
+        self._mark: tuple | None = None        # sort key of the last dated row fetched (high-water mark)
+        self._undated_mark: int | None = None  # highest id among rows with no published_at (those sort last)
+        self.synced = 0                        # rows appended by sync() since the last full load
+        self.degraded = False                  # serving the snapshot because the table was unreachable
+
+    def __len__(self) -> int:
+        return len(self._questions)
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    @property
+    def topics(self) -> list[str]:
+        return sorted(self._topics)
+
+    def topic_offsets(self, topic: str) -> list[int]:
+        """Offsets of the questions in `topic` (case-insensitive); [] if there are none."""
+        return self._topics.get(topic.strip().lower(), [])
+
+    def _swap_in(self, questions: list[dict]):
+        topics: dict[str, list[int]] = {}
+        self._index(topics, questions, 0)
+        self._questions, self._topics = questions, topics
+
+    @staticmethod
+    def _index(topics: dict[str, list[int]], questions: list[dict], start: int):
+        for offset, q in enumerate(questions, start):
+            if q["topic"]:
+                topics.setdefault(q["topic"].strip().lower(), []).append(offset)
+
+    def _compile_rows(self, rows: list[dict]) -> tuple[list[dict], int]:
+        questions = []
+        skipped = 0
+        for row in rows:
+            try:
+                with metrics.timed("compile_question"):
+                    questions.append(compile_question(row))
+            except (RuntimeError, TypeError, ValueError) as e:   # one bad row must not sink the load
+                skipped += 1
+                logging.warning("Skipping question id=%s: %s", row.get("id"), e)
+        return questions, skipped
+
+    def _row_mark(self, row: dict) -> tuple:
+        """Where a row sorts under the current plan: (published_at, id) or (id,)."""
+        if self.plan is not None and self.plan[1]:
+            return (row.get("published_at"), row.get("id"))
+        return (row.get("id"),)
+
+    def _advance_marks(self, rows: list[dict]):
+        for row in rows:
+            key = self._row_mark(row)
+            if key[0] is None and len(key) == 2:
+                # No published_at: tracked on its own so one undated row doesn't leave us without a mark
+                if self._undated_mark is None or key[1] > self._undated_mark:
+                    self._undated_mark = key[1]
+            elif self._mark is None or key > self._mark:
+                self._mark = key
+
+    def get(self, offset: int) -> dict:
+        """O(1) lookup. Returned dicts are shared — treat them as read-only."""
+        if not 0 <= offset < len(self._questions):
+            raise IndexError("Offset out of bounds or no data returned.")
+        return self._questions[offset]
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            if self._lock.locked():
+                async with self._lock:   # a load is already running (e.g. the startup warm-up): wait for it
+                    pass
+            if not self.loaded:
+                await self.load()
+
+    async def load(self):
+        """(Re)load the whole table (or bank file) and swap it in atomically."""
+        async with self._lock:
+            if self.bank_path:
+                self._swap_in(await asyncio.to_thread(read_bank, self.bank_path))
+                self.skipped = 0
+                self.loaded_at = time.monotonic()
+                logging.info("Loaded %d precompiled questions from %s", len(self._questions), self.bank_path)
+                return
+            try:
+                rows = await run_db(self._fetch_all_sync, timeout=DB_BULK_TIMEOUT)
+            except Exception:
+                if self.loaded or not self.snapshot_path or not os.path.exists(self.snapshot_path):
+                    raise  # keep what we have (or nothing to fall back to)
+                self._swap_in(await asyncio.to_thread(read_bank, self.snapshot_path))
+                self.degraded = True   # next sync() retries a full load
+                self.loaded_at = time.monotonic()
+                logging.warning("Question table unreachable; serving %d questions from snapshot %s",
+                                len(self._questions), self.snapshot_path, exc_info=True)
+                return
+            questions, skipped = self._compile_rows(rows)
+            self._swap_in(questions)
+            self._mark = self._undated_mark = None
+            self._advance_marks(rows)
+            self.skipped = skipped
+            self.synced = 0
+            self.degraded = False
+            self.loaded_at = time.monotonic()
+            logging.info("Loaded %d questions (%d skipped)", len(questions), skipped)
+        if self.snapshot_path and questions:
+            try:
+                await asyncio.to_thread(write_bank, self.snapshot_path, questions, f"supabase:{self.table}")
+            except OSError:
+                logging.warning("Could not write question snapshot %s", self.snapshot_path, exc_info=True)
+
+    async def sync(self) -> int:
+        """
+        Append rows that sort after the last one we have. Returns how many
+        questions were added. Falls back to load() when there is no usable mark.
+        """
+        if self.bank_path:
+            return 0
+        if not self.loaded or self.degraded or self.plan is None:
+            # Nothing loaded yet, serving the snapshot, or the table was empty
+            before = len(self)
+            await self.load()
+            return max(0, len(self) - before)
+        async with self._lock:
+            rows = await run_db(self._fetch_new_sync, self._mark, self._undated_mark)
+            if not rows:
+                return 0
+            questions, skipped = self._compile_rows(rows)
+            # One synchronous step: readers see the old bank or the new one, never half
+            start = len(self._questions)
+            self._questions.extend(questions)
+            self._index(self._topics, questions, start)
+            self._advance_marks(rows)
+            self.skipped += skipped
+            self.synced += len(questions)
+            logging.info("Synced %d new questions (%d skipped); bank has %d", len(questions), skipped, len(self))
+            return len(questions)
+
+    async def refresh_forever(self):
+        """
+        Background task: sync() every `sync_interval` seconds and do a full
+        load() every `ttl` seconds; keep the current bank on failure.
+        """
+        last_full = time.monotonic()
+        while True:
+            await asyncio.sleep(self.sync_interval if self.sync_interval > 0 else self.ttl)
+            try:
+                if self.sync_interval <= 0 or time.monotonic() - last_full >= self.ttl:
+                    await self.load()
+                    last_full = time.monotonic()
+                else:
+                    await self.sync()
+            except Exception:
+                logging.exception("Question bank refresh failed; keeping previous copy")
+
+    def describe_plan(self) -> str:
+        if self.bank_path:
+            return f"precompiled bank file {self.bank_path}"
+        if self.degraded:
+            return f"snapshot {self.snapshot_path} (table unreachable)"
+        if self.plan is None:
+            return "not probed yet"
+        with_kind, by_published = self.plan
+        where = "kind = 'mcq'" if with_kind else "all rows"
+        order = "published_at, id" if by_published else "id"
+        return f"{where}, ordered by {order}"
+
+    # ----- blocking helpers (run in the DB pool) -----
+
+    def _query(self, with_kind: bool, order_by_published: bool, start: int, end: int,
+               after: tuple | None = None, undated: bool = False):
+        q = self._client.table(self.table).select("*")
+        if with_kind:
+            q = q.eq("kind", "mcq")
+        if undated:
+            # Only rows with no published_at, past `after` by id
+            q = q.is_("published_at", "null")
+            if after is not None:
+                q = q.gt("id", after[0])
+        elif after is not None:
+            if not order_by_published:
+                q = q.gt("id", after[0])
+            elif after[0] is None:
+                q = q.not_.is_("published_at", "null")   # every dated row (we haven't seen one yet)
+            else:
+                # gte, not gt: rows sharing the mark's published_at are sorted out by id afterwards
+                q = q.gte("published_at", after[0])
+        if order_by_published:
+            q = q.order("published_at", desc=False).order("id", desc=False)
+        else:
+            q = q.order("id", desc=False)
+        return q.range(start, end).execute()
+
+    def _probe_sync(self) -> tuple[tuple[bool, bool] | None, list[dict]]:
+        """Try each query plan until one returns rows; return it with its first page."""
+        for i, (with_kind, by_published) in enumerate(self.QUERY_PLANS):
+            try:
+                rows = self._query(with_kind, by_published, 0, self.page_size - 1).data or []
+            except Exception as e:
+                if i == len(self.QUERY_PLANS) - 1 or is_outage(e):
+                    raise  # the database is unreachable, not missing a column: other plans won't help
+                rows = []
+            if rows:
+                return (with_kind, by_published), rows
+            self.fallbacks += 1
+        return None, []
+
+    def _fetch_all_sync(self) -> list[dict]:
+        return [row for page in self.iter_pages_sync() for row in page]
+
+    def _fetch_new_sync(self, mark: tuple | None, undated_mark: int | None) -> list[dict]:
+        rows = [r for r in self._fetch_after_sync(mark or (None,)) if mark is None or self._row_mark(r) > mark]
+        if self.plan[1]:
+            # Undated rows sort after every dated one, so a new one never moves the dated mark
+            rows += self._fetch_after_sync((undated_mark,) if undated_mark is not None else None, undated=True)
+        return rows
+
+    def _fetch_after_sync(self, after: tuple | None, undated: bool = False) -> list[dict]:
+        rows: list[dict] = []
+        while True:
+            page = self._query(*self.plan, len(rows), len(rows) + self.page_size - 1,
+                               after=after, undated=undated).data or []
+            rows.extend(page)
+            if len(page) < self.page_size:
+                break
+        return rows
+
+    def iter_pages_sync(self):
+        """Yield the table page by page, in bank order (blocking; ingest.py streams this)."""
+        # Reuse the plan we probed last time; only re-probe if it stops working
+        # (e.g. the schema changed under us).
+        page: list[dict] = []
+        plan = self.plan
+        if plan is not None:
+            try:
+                page = self._query(*plan, 0, self.page_size - 1).data or []
+            except Exception:
+                logging.warning("Question query plan (%s) failed; re-probing schema", self.describe_plan())
+                page = []
+        if not page:
+            plan, page = self._probe_sync()
+            self.plan = plan
+            if plan is not None:
+                logging.info("Question query plan: %s", self.describe_plan())
+
+        # Page through the rest with that same plan.
+        start = 0
+        while page:
+            yield page
+            if len(page) < self.page_size:
+                break
+            start += len(page)
+            page = self._query(*plan, start, start + self.page_size - 1).data or []
@@ -0,0 +1,481 @@
+# state.py — durable per-user quiz state (scores, progress, active sessions)
+#
+# StateStore owns the SCORES / PROGRESS / ACTIVE_USERS structures the bot
+# mutates. Handlers change them in memory and call touch(user_id), which is
+# O(1); a background task periodically writes a snapshot of every touched
+# user to the configured backend. Backends store one row per user, so a
+# restart reloads in time proportional to the number of users, never to the
+# number of answers ever given.
+#
+# It also remembers each user's quiz thread per channel, so !quiz can reuse
+# it instead of creating a new thread every time.
+#
+# When several bot processes share one backend (see launcher.py), the backend
+# is also the source of truth for "is this user already in a quiz?":
+# begin_session() claims the user's row atomically, so the same user can never
+# hold two sessions in two workers. Claims are tagged with the worker's id
+# (WORKER_ID), so a worker that restarts can pick its own sessions back up
+# without waiting for them to go stale.
+#
+# Calls to a remote backend go through db.run_db (timeouts + circuit breaker).
+# If it can't be reached, the bot carries on with what it has in memory:
+# claims are granted locally and touched users stay dirty until a flush works.
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+import metrics
+from db import DB_BULK_TIMEOUT, DatabaseUnavailable, is_outage, run_db
+
+# An active claim not refreshed for this long is considered abandoned (the
+# session's buttons have long since timed out, or its process died).
+ACTIVE_STALE_AFTER = 300
+# Users per request in claim_many() (their ids go in the URL)
+CLAIM_BATCH = 200
+
+# (user_id, correct, total, progress, active, updated_at, seen)
+# `seen` is a bitset of question offsets the user has been shown (bit n =
+# offset n), stored as hex text; it stops random modes from repeating.
+Row = tuple[int, int, int, int, bool, float, int]
+# (channel_id, user_id, thread_id); thread_id 0 = forgotten
+ThreadRow = tuple[int, int, int]
+
+
+def _quoted(value: str) -> str:
+    """A PostgREST filter value in double quotes, so commas, dots and parens in it are literal."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class MemoryBackend:
+    """Keeps nothing — state lives and dies with the process."""
+    name = "memory"
+    remote = False
+
+    def load(self) -> list[Row]:
+        return []
+
+    def write(self, rows: list[Row]):
+        pass
+
+    def claim(self, user_id: int, now: float, stale_before: float) -> tuple[bool, Row | None]:
+        return True, None
+
+    def claim_many(self, user_ids: list[int], now: float, stale_before: float) -> list[tuple[int, Row | None]]:
+        return [(user_id, None) for user_id in user_ids]
+
+    def load_threads(self) -> list[ThreadRow]:
+        return []
+
+    def write_threads(self, rows: list[ThreadRow]):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """One row per user in a local SQLite file (WAL mode)."""
+    name = "sqlite"
+    remote = False
+
+    def __init__(self, path: str, owner: str = "main"):
+        self.path = path
+        self.owner = owner
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            create table if not exists user_state (
+                user_id    integer primary key,
+                correct    integer not null,
+                total      integer not null,
+                progress   integer not null,
+                active     integer not null,
+                updated_at real    not null,
+                owner      text    not null default '',
+                seen       text    not null default ''
+            )
+        """)
+        self._conn.execute("""
+            create table if not exists user_thread (
+                channel_id integer not null,
+                user_id    integer not null,
+                thread_id  integer not null,
+                primary key (channel_id, user_id)
+            )
+        """)
+        # Files created by earlier versions
+        cols = {row[1] for row in self._conn.execute("pragma table_info(user_state)")}
+        for col in ("owner", "seen"):
+            if col not in cols:
+                self._conn.execute(f"alter table user_state add column {col} text not null default ''")
+        self._conn.commit()
+
+    def load(self) -> list[Row]:
+        with self._lock:
+            cur = self._conn.execute(
+                "select user_id, correct, total, progress, active, updated_at, seen from user_state"
+            )
+            return [(u, c, t, p, bool(a), ts, int(seen or "0", 16)) for u, c, t, p, a, ts, seen in cur]
+
+    def write(self, rows: list[Row]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "insert or replace into user_state values (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(u, c, t, p, int(a), ts, self.owner, f"{seen:x}") for u, c, t, p, a, ts, seen in rows],
+            )
+
+    def claim(self, user_id: int, now: float, stale_before: float) -> tuple[bool, Row | None]:
+        """Atomically mark the user active unless another process holds a fresh claim."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "insert or ignore into user_state values (?, 0, 0, 0, 0, 0, '', '')", (user_id,)
+            )
+            cur = self._conn.execute(
+                "update user_state set active = 1, updated_at = ?, owner = ? "
+                "where user_id = ? and (active = 0 or updated_at < ? or owner = ?)",
+                (now, self.owner, user_id, stale_before, self.owner),
+            )
+            if cur.rowcount == 0:
+                return False, None
+            u, c, t, p, a, ts, seen = self._conn.execute(
+                "select user_id, correct, total, progress, active, updated_at, seen from user_state where user_id = ?",
+                (user_id,),
+            ).fetchone()
+            return True, (u, c, t, p, bool(a), ts, int(seen or "0", 16))
+
+    def claim_many(self, user_ids: list[int], now: float, stale_before: float) -> list[tuple[int, Row | None]]:
+        """claim() for each user; returns the ones claimed with their rows (a local file: no round trips to save)."""
+        claimed = []
+        for user_id in user_ids:
+            ok, row = self.claim(user_id, now, stale_before)
+            if ok:
+                claimed.append((user_id, row))
+        return claimed
+
+    def load_threads(self) -> list[ThreadRow]:
+        with self._lock:
+            return self._conn.execute(
+                "select channel_id, user_id, thread_id from user_thread where thread_id != 0"
+            ).fetchall()
+
+    def write_threads(self, rows: list[ThreadRow]):
+        with self._lock, self._conn:
+            self._conn.executemany("insert or replace into user_thread values (?, ?, ?)", rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SupabaseBackend:
+    """One row per user in a Supabase table (see README for the SQL)."""
+    name = "supabase"
+    remote = True
+
+    def __init__(self, client, table: str = "quiz_state", page_size: int = 1000, owner: str = "main",
+                 threads_table: str = "quiz_threads"):
+        self._client = client
+        self.table = table
+        self.threads_table = threads_table
+        self.page_size = page_size
+        self.owner = owner
+
+    def load(self) -> list[Row]:
+        rows: list[Row] = []
+        start = 0
+        while True:
+            page = (self._client.table(self.table)
+                    .select("user_id, correct, total, progress, active, updated_at, seen")
+                    .order("user_id")
+                    .range(start, start + self.page_size - 1)
+                    .execute().data or [])
+            rows.extend((int(r["user_id"]), r["correct"], r["total"], r["progress"],
+                         bool(r["active"]), float(r["updated_at"]), int(r.get("seen") or "0", 16)) for r in page)
+            if len(page) < self.page_size:
+                return rows
+            start += self.page_size
+
+    def write(self, rows: list[Row]):
+        self._client.table(self.table).upsert([
+            {"user_id": u, "correct": c, "total": t, "progress": p, "active": a, "updated_at": ts,
+             "owner": self.owner, "seen": f"{seen:x}"}
+            for u, c, t, p, a, ts, seen in rows
+        ], on_conflict="user_id").execute()
+
+    def claim(self, user_id: int, now: float, stale_before: float) -> tuple[bool, Row | None]:
+        """Conditional UPDATE (free, stale or our own claims only); INSERT if the user has no row yet."""
+        res = (self._client.table(self.table)
+               .update({"active": True, "updated_at": now, "owner": self.owner})
+               .eq("user_id", user_id)
+               .or_(f"active.eq.false,updated_at.lt.{stale_before},owner.eq.{_quoted(self.owner)}")
+               .execute())
+        if res.data:
+            return True, self._claimed_row(res.data[0], now)
+        try:
+            self._client.table(self.table).insert({
+                "user_id": user_id, "correct": 0, "total": 0, "progress": 0,
+                "active": True, "updated_at": now, "owner": self.owner,
+            }).execute()
+        except Exception as e:
+            if getattr(e, "code", None) != "23505":
+                raise
+            # Unique violation: the row exists and someone else holds a fresh claim
+            return False, None
+        return True, None
+
+    def claim_many(self, user_ids: list[int], now: float, stale_before: float) -> list[tuple[int, Row | None]]:
+        """
+        claim() for many users with two requests per CLAIM_BATCH users instead
+        of one or two each: the same conditional UPDATE over all of them, then
+        an INSERT … ON CONFLICT DO NOTHING for the rest (rows that exist are
+        held by someone else and come back empty).
+        """
+        claimed: list[tuple[int, Row | None]] = []
+        for start in range(0, len(user_ids), CLAIM_BATCH):
+            batch = user_ids[start:start + CLAIM_BATCH]
+            res = (self._client.table(self.table)
+                   .update({"active": True, "updated_at": now, "owner": self.owner})
+                   .in_("user_id", batch)
+                   .or_(f"active.eq.false,updated_at.lt.{stale_before},owner.eq.{_quoted(self.owner)}")
+                   .execute())
+            rows = {int(r["user_id"]): r for r in res.data or []}
+            claimed.extend((user_id, self._claimed_row(r, now)) for user_id, r in rows.items())
+            rest = [user_id for user_id in batch if user_id not in rows]
+            if rest:
+                res = self._client.table(self.table).upsert([
+                    {"user_id": user_id, "correct": 0, "total": 0, "progress": 0,
+                     "active": True, "updated_at": now, "owner": self.owner}
+                    for user_id in rest
+                ], on_conflict="user_id", ignore_duplicates=True).execute()
+                claimed.extend((int(r["user_id"]), None) for r in res.data or [])
+        return claimed
+
+    @staticmethod
+    def _claimed_row(r: dict, now: float) -> Row:
+        return (int(r["user_id"]), r["correct"], r["total"], r["progress"], True, now,
+                int(r.get("seen") or "0", 16))
+
+    def load_threads(self) -> list[ThreadRow]:
+        rows: list[ThreadRow] = []
+        while True:
+            page = (self._client.table(self.threads_table)
+                    .select("channel_id, user_id, thread_id")
+                    .neq("thread_id", 0)
+                    .order("channel_id")
+                    .order("user_id")
+                    .range(len(rows), len(rows) + self.page_size - 1)
+                    .execute().data or [])
+            rows.extend((int(r["channel_id"]), int(r["user_id"]), int(r["thread_id"])) for r in page)
+            if len(page) < self.page_size:
+                return rows
+
+    def write_threads(self, rows: list[ThreadRow]):
+        self._client.table(self.threads_table).upsert([
+            {"channel_id": c, "user_id": u, "thread_id": t} for c, u, t in rows
+        ], on_conflict="channel_id,user_id").execute()
+
+    def close(self):
+        pass
+
+
+class StateStore:
+    def __init__(self, backend, flush_interval: float = 1.0):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.scores: dict[int, dict[str, int]] = {}   # {user_id: {"correct": int, "total": int}}
+        self.progress: dict[int, int] = {}            # {user_id: next question offset (0-based)}
+        self.active: set[int] = set()                 # users with a running session in this process
+        self._claiming: set[int] = set()              # users whose claim is in flight
+        self.seen: dict[int, int] = {}                # {user_id: bitset of offsets shown}
+        self.threads: dict[tuple[int, int], int] = {} # {(channel_id, user_id): quiz thread id}
+        self._dirty: set[int] = set()
+        self._dirty_threads: set[tuple[int, int]] = set()
+        self._task: asyncio.Task | None = None
+
+    async def _call(self, fn, *args, timeout: float | None = None):
+        if self.backend.remote:
+            return await run_db(fn, *args, timeout=timeout)
+        return await asyncio.to_thread(fn, *args)
+
+    def touch(self, user_id: int):
+        """Mark a user's state as changed; it is persisted on the next flush."""
+        self._dirty.add(user_id)
+
+    async def load(self):
+        """Fill the in-memory structures (in place) from the backend."""
+        started = time.perf_counter()
+        try:
+            rows = await self._call(self.backend.load, timeout=DB_BULK_TIMEOUT)
+        except Exception:
+            if not self.backend.remote:
+                raise
+            # Start empty; each user's row is still fetched by their next claim
+            logging.warning("Could not load state from %s; starting without it", self.backend.name, exc_info=True)
+            return
+        for user_id, correct, total, progress, active, updated_at, seen in rows:
+            self.scores[user_id] = {"correct": correct, "total": total}
+            self.progress[user_id] = progress
+            if seen:
+                self.seen[user_id] = seen
+        # `active` is not restored here: it only lists sessions owned by this
+        # process. Claims from other workers (or from before a crash) are
+        # checked — and expire — through begin_session().
+        for channel_id, user_id, thread_id in await self._call(self.backend.load_threads, timeout=DB_BULK_TIMEOUT):
+            self.threads[(channel_id, user_id)] = thread_id
+        logging.info("Loaded state for %d users (%d quiz threads) from %s in %.1f ms",
+                     len(rows), len(self.threads), self.backend.name, (time.perf_counter() - started) * 1000)
+
+    def remember_thread(self, channel_id: int, user_id: int, thread_id: int):
+        """Record the user's quiz thread under a channel; persisted on the next flush."""
+        self.threads[(channel_id, user_id)] = thread_id
+        self._dirty_threads.add((channel_id, user_id))
+
+    def forget_thread(self, channel_id: int, user_id: int):
+        """The thread is gone (deleted, locked, no access); the next !quiz makes a new one."""
+        if self.threads.pop((channel_id, user_id), None) is not None:
+            self._dirty_threads.add((channel_id, user_id))
+
+    async def begin_session(self, user_id: int) -> bool:
+        """
+        Claim a quiz session for this user. False if they already have one,
+        here or in another worker. On success the user's scores/progress are
+        refreshed from the backend, in case another worker changed them.
+        """
+        if user_id in self.active or user_id in self._claiming:
+            return False   # a second click while the first one's claim is in flight loses
+        self._claiming.add(user_id)
+        try:
+            return await self._claim(user_id)
+        finally:
+            self._claiming.discard(user_id)
+
+    async def _claim(self, user_id: int) -> bool:
+        now = time.time()
+        try:
+            ok, row = await self._call(self.backend.claim, user_id, now, now - ACTIVE_STALE_AFTER)
+        except Exception as e:
+            # Only an outage is forgiven; a schema or query error must not hand
+            # out claims that no other worker can see
+            if not (self.backend.remote and is_outage(e)):
+                raise
+            # Backend unreachable: only this process can vouch for the user, so let them play
+            logging.warning("Session claim for %s failed; granting it locally", user_id, exc_info=True)
+            metrics.incr("state_claim_degraded")
+            ok, row = True, None
+        if not ok:
+            return False
+        self._claimed(user_id, row)
+        return True
+
+    async def begin_sessions(self, user_ids) -> set[int]:
+        """
+        begin_session() for many users at once, in one backend call instead of
+        one per user. Returns the users claimed; anyone with a session (or a
+        claim in flight) in this process is left out.
+        """
+        wanted = [u for u in user_ids if u not in self.active and u not in self._claiming]
+        if not wanted:
+            return set()
+        self._claiming.update(wanted)
+        try:
+            now = time.time()
+            try:
+                claimed = await self._call(self.backend.claim_many, wanted, now, now - ACTIVE_STALE_AFTER)
+            except Exception as e:
+                if not (self.backend.remote and is_outage(e)):
+                    raise
+                logging.warning("Session claims for %d users failed; granting them locally", len(wanted), exc_info=True)
+                metrics.incr("state_claim_degraded")
+                claimed = [(u, None) for u in wanted]
+            for user_id, row in claimed:
+                self._claimed(user_id, row)
+            return {user_id for user_id, _ in claimed}
+        finally:
+            self._claiming.difference_update(wanted)
+
+    def _claimed(self, user_id: int, row: Row | None):
+        if row is not None:
+            _, correct, total, progress, _, _, seen = row
+            self.scores[user_id] = {"correct": correct, "total": total}
+            self.progress[user_id] = progress
+            self.seen[user_id] = seen
+        self.active.add(user_id)
+
+    def mark_seen(self, user_id: int, offset: int):
+        self.seen[user_id] = self.seen.get(user_id, 0) | 1 << offset
+        self.touch(user_id)
+
+    def has_seen(self, user_id: int, offset: int) -> bool:
+        return bool(self.seen.get(user_id, 0) >> offset & 1)
+
+    def clear_seen(self, user_id: int, offsets):
+        """Forget that these offsets were shown (to go round a topic again)."""
+        if isinstance(offsets, range) and offsets.step == 1:
+            mask = ((1 << len(offsets)) - 1) << offsets.start
+        else:
+            mask = 0
+            for offset in offsets:
+                mask |= 1 << offset
+        self.seen[user_id] = self.seen.get(user_id, 0) & ~mask
+        self.touch(user_id)
+
+    def end_session(self, user_id: int):
+        """Release the claim; the next flush writes active = false."""
+        self.active.discard(user_id)
+        self.touch(user_id)
+
+    def _snapshot(self, user_id: int, now: float) -> Row:
+        s = self.scores.get(user_id, {"correct": 0, "total": 0})
+        return (user_id, s["correct"], s["total"], self.progress.get(user_id, 0),
+                user_id in self.active, now, self.seen.get(user_id, 0))
+
+    async def flush(self):
+        if self._dirty_threads:
+            dirty_threads, self._dirty_threads = self._dirty_threads, set()
+            rows = [(c, u, self.threads.get((c, u), 0)) for c, u in dirty_threads]
+            try:
+                await self._call(self.backend.write_threads, rows)
+            except Exception:
+                self._dirty_threads |= dirty_threads
+                raise
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        now = time.time()
+        rows = [self._snapshot(u, now) for u in dirty]
+        try:
+            await self._call(self.backend.write, rows)
+        except Exception:
+            # Keep them dirty so the next flush tries again
+            self._dirty |= dirty
+            raise
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except DatabaseUnavailable as e:
+                logging.warning("State flush to %s skipped: %s", self.backend.name, e)
+            except Exception:
+                logging.exception("State flush to %s failed", self.backend.name)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self.backend.close()